@@ -0,0 +1,230 @@
+import datetime
+import itertools
+import os
+import socket
+import sys
+import time
+import logging
+
+import yaml
+
+log = logging.getLogger(__name__)
+log.propagate = False
+log.setLevel(logging.INFO)
+handler = logging.StreamHandler(stream=sys.stdout)
+handler.setFormatter(
+    logging.Formatter("%(asctime)s %(name)s %(levelname)s %(message)s")
+)
+log.addHandler(handler)
+
+
+def get_default_thread_candidates():
+    """
+    Powers of two up to the number of available cpus
+    """
+    cpu_count = os.cpu_count() or 1
+    candidates = []
+    threads = 1
+    while threads < cpu_count:
+        candidates.append(threads)
+        threads *= 2
+    candidates.append(cpu_count)
+    return candidates
+
+
+def get_profile_path(profile_dir, hostname=None):
+    if hostname is None:
+        hostname = socket.gethostname()
+    return os.path.join(profile_dir, hostname + ".yaml")
+
+
+def load_profile(path):
+    """
+    Load a performance profile, returns None if there is no (valid) profile
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as stream:
+        try:
+            profile = yaml.safe_load(stream)
+        except yaml.YAMLError as exc:
+            log.error("Could not parse performance profile {}: {}".format(path, exc))
+            return None
+    if not isinstance(profile, dict) or not isinstance(profile.get("settings"), dict):
+        log.error("Invalid performance profile: {}".format(path))
+        return None
+    return profile
+
+
+def save_profile(path, profile):
+    profile_dir = os.path.dirname(path)
+    if profile_dir and not os.path.exists(profile_dir):
+        os.makedirs(profile_dir)
+    with open(path, "w") as f:
+        yaml.safe_dump(profile, f, sort_keys=False)
+    log.info("Saved performance profile to: {}".format(path))
+
+
+SEARCH_STRATEGIES = ["coordinate", "grid"]
+
+
+class Autotuner:
+    """
+    Run the pipeline on sample images with the candidate settings and pick
+    the settings with the highest throughput.
+
+    search:
+        coordinate: tune one setting at a time with the others fixed to the
+            best values so far, repeated for at most max_rounds rounds
+        grid: every combination of the candidate values
+
+    apply_fn(settings) is called before each combination is measured,
+    process_fn(image) runs the pipeline on a single image.
+    """
+
+    def __init__(
+        self,
+        process_fn,
+        apply_fn,
+        images,
+        candidates,
+        warmup=1,
+        search="coordinate",
+        max_rounds=2,
+        start=None,
+    ):
+        if search not in SEARCH_STRATEGIES:
+            raise ValueError(
+                "Unknown autotune search {}, use one of {}".format(
+                    search, SEARCH_STRATEGIES
+                )
+            )
+        self.process_fn = process_fn
+        self.apply_fn = apply_fn
+        self.images = images
+        self.candidates = candidates
+        self.warmup = warmup
+        self.search = search
+        self.max_rounds = max_rounds
+        self.start = start or {}
+        self.results = []
+        self.measured = {}  # tuple of the values -> result
+        self.started = None
+
+    def _measure(self, settings):
+        self.apply_fn(settings)
+        for i in range(self.warmup):
+            self.process_fn(self.images[i % len(self.images)])
+        latencies = []
+        t_start = time.time()
+        for image in self.images:
+            t0 = time.time()
+            self.process_fn(image)
+            latencies.append(time.time() - t0)
+        total_time = time.time() - t_start
+        latencies.sort()
+        return {
+            "settings": settings,
+            "images_per_second": round(len(self.images) / total_time, 3),
+            "latency_mean": round(sum(latencies) / len(latencies), 4),
+            "latency_p50": round(latencies[len(latencies) // 2], 4),
+            "latency_max": round(latencies[-1], 4),
+        }
+
+    def _get_result(self, settings, expected):
+        """
+        Measure settings unless they were measured before
+        """
+        key = tuple(settings[n] for n in self.candidates.keys())
+        if key in self.measured:
+            return self.measured[key]
+        result = self._measure(settings)
+        log.info(
+            "{}: {} images/s, mean latency {} s".format(
+                settings, result["images_per_second"], result["latency_mean"]
+            )
+        )
+        self.measured[key] = result
+        self.results.append(result)
+        if len(self.results) == 1:
+            duration = time.time() - self.started
+            log.info(
+                "First combination took {:.0f} s, estimated run time {:.0f} s".format(
+                    duration, duration * expected
+                )
+            )
+        return result
+
+    def count_combinations(self):
+        """
+        Number of combinations measured by a grid search or by the first
+        round of a coordinate search
+        """
+        sizes = [len(values) for values in self.candidates.values()]
+        if self.search == "grid":
+            count = 1
+            for size in sizes:
+                count *= size
+            return count
+        return 1 + sum(size - 1 for size in sizes)
+
+    @staticmethod
+    def _best(results):
+        # highest throughput first, lower latency breaks ties
+        return sorted(
+            results,
+            key=lambda r: (-r["images_per_second"], r["latency_p50"]),
+        )[0]
+
+    def run(self):
+        """
+        Returns the best result, all results are kept in self.results
+        """
+        if len(self.images) == 0:
+            raise ValueError("No sample images available for autotuning")
+        names = list(self.candidates.keys())
+        expected = self.count_combinations()
+        log.info(
+            "Autotuning ({} search) {} combinations on {} images".format(
+                self.search, expected, len(self.images)
+            )
+        )
+        self.results = []
+        self.measured = {}
+        self.started = time.time()
+        if self.search == "grid":
+            for values in itertools.product(*[self.candidates[n] for n in names]):
+                self._get_result(dict(zip(names, values)), expected)
+            return self._best(self.results)
+        best = {
+            n: (
+                self.start[n]
+                if self.start.get(n) in self.candidates[n]
+                else self.candidates[n][0]
+            )
+            for n in names
+        }
+        for i in range(self.max_rounds):
+            previous = dict(best)
+            for name in names:
+                results = [
+                    self._get_result(dict(best, **{name: value}), expected)
+                    for value in self.candidates[name]
+                ]
+                best = dict(self._best(results)["settings"])
+            if best == previous:
+                break
+        return self._best(self.results)
+
+    def generate_profile(self, best, hostname=None):
+        if hostname is None:
+            hostname = socket.gethostname()
+        return {
+            "hostname": hostname,
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "cpu_count": os.cpu_count(),
+            "number_of_images": len(self.images),
+            "settings": best["settings"],
+            "best": {k: v for k, v in best.items() if k != "settings"},
+            "results": self.results,
+        }
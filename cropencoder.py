@@ -0,0 +1,137 @@
+import base64
+import sys
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+except ImportError:
+    TurboJPEG = None
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+log = logging.getLogger(__name__)
+log.propagate = False
+log.setLevel(logging.INFO)
+handler = logging.StreamHandler(stream=sys.stdout)
+handler.setFormatter(
+    logging.Formatter("%(asctime)s %(name)s %(levelname)s %(message)s")
+)
+log.addHandler(handler)
+
+ENCODERS = ["turbojpeg", "opencv", "pillow"]
+
+
+def get_available_encoder():
+    if TurboJPEG is not None:
+        try:
+            TurboJPEG()
+            return "turbojpeg"
+        except Exception:
+            # the python package is installed, but not libturbojpeg
+            pass
+    if cv2 is not None:
+        return "opencv"
+    return "pillow"
+
+
+class CropEncoder:
+    """
+    Encode RGB crops (numpy arrays) as base64 JPEG, optionally in a thread pool.
+
+    encoder: turbojpeg, opencv (libjpeg-turbo in the opencv-python wheels),
+    pillow or None for the fastest available encoder
+    """
+
+    def __init__(self, quality=75, max_dimension=None, workers=0, encoder=None):
+        if encoder is None:
+            encoder = get_available_encoder()
+        if encoder not in ENCODERS:
+            raise ValueError(
+                "Unknown crop encoder {}, use one of {}".format(encoder, ENCODERS)
+            )
+        self.encoder = encoder
+        self.quality = quality
+        self.max_dimension = max_dimension
+        self.pool = None
+        self.set_workers(workers)
+        self.turbojpeg = None
+        if self.encoder == "turbojpeg":
+            self.turbojpeg = TurboJPEG()
+        log.info(
+            "Crop encoder: {}, quality: {}, max dimension: {}, workers: {}".format(
+                self.encoder, self.quality, self.max_dimension, self.workers
+            )
+        )
+
+    def set_workers(self, workers):
+        if self.pool is not None:
+            self.pool.shutdown()
+        self.workers = int(workers or 0)
+        self.pool = None
+        if self.workers > 0:
+            self.pool = ThreadPoolExecutor(max_workers=self.workers)
+
+    def _resize(self, crop):
+        height, width = crop.shape[0], crop.shape[1]
+        if not self.max_dimension or max(width, height) <= self.max_dimension:
+            return crop
+        scale = self.max_dimension / max(width, height)
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        if cv2 is not None:
+            return cv2.resize(crop, size, interpolation=cv2.INTER_AREA)
+        return np.asarray(Image.fromarray(crop).resize(size, Image.BILINEAR))
+
+    def encode(self, crop):
+        """
+        Returns the crop as base64 encoded JPEG
+        """
+        if isinstance(crop, Image.Image):
+            crop = np.asarray(crop.convert("RGB"))
+        crop = np.ascontiguousarray(self._resize(crop))
+        if self.encoder == "turbojpeg":
+            data = self.turbojpeg.encode(
+                crop, quality=self.quality, pixel_format=TJPF_RGB
+            )
+        elif self.encoder == "opencv":
+            ok, buffer = cv2.imencode(
+                ".jpg",
+                cv2.cvtColor(crop, cv2.COLOR_RGB2BGR),
+                [cv2.IMWRITE_JPEG_QUALITY, self.quality],
+            )
+            if not ok:
+                raise ValueError("Could not encode crop")
+            data = buffer.tobytes()
+        else:
+            bio = BytesIO()
+            Image.fromarray(crop).save(bio, format="JPEG", quality=self.quality)
+            data = bio.getvalue()
+        return base64.b64encode(data).decode("utf-8")
+
+    def encode_pollinators(self, pollinators):
+        """
+        Encode the crops of all pollinators, returns the time spent in seconds
+        """
+        t0 = time.time()
+        crops = [p.crop for p in pollinators]
+        if self.pool is not None and len(crops) > 1:
+            encoded = list(self.pool.map(self.encode, crops))
+        else:
+            encoded = [self.encode(c) for c in crops]
+        for pollinator, encoded_crop in zip(pollinators, encoded):
+            pollinator.encoded_crop = encoded_crop
+        return time.time() - t0
+
+    def get_metadata(self):
+        return {
+            "encoder": self.encoder,
+            "quality": self.quality,
+            "max_dimension": self.max_dimension,
+        }
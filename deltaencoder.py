@@ -0,0 +1,264 @@
+import copy
+import json
+import sys
+import time
+import logging
+
+log = logging.getLogger(__name__)
+log.propagate = False
+log.setLevel(logging.INFO)
+handler = logging.StreamHandler(stream=sys.stdout)
+handler.setFormatter(
+    logging.Formatter("%(asctime)s %(name)s %(levelname)s %(message)s")
+)
+log.addHandler(handler)
+
+DETECTION_TYPES = ["flowers", "pollinators"]
+
+
+def diff_fields(old, new, score_tolerance=0):
+    """
+    Top-level keys which were changed or removed.
+    Changes of the score up to score_tolerance are ignored.
+    """
+    changed = {}
+    for key, value in new.items():
+        if key not in old:
+            changed[key] = value
+        elif key == "score" and None not in (old[key], value):
+            if abs(value - old[key]) > score_tolerance:
+                changed[key] = value
+        elif old[key] != value:
+            changed[key] = value
+    removed = [k for k in old.keys() if k not in new]
+    return {"changed": changed, "removed": removed}
+
+
+def apply_fields(old, delta):
+    result = copy.deepcopy(old)
+    for key in delta.get("removed", []):
+        result.pop(key, None)
+    result.update(copy.deepcopy(delta.get("changed", {})))
+    return result
+
+
+def diff_metadata(old, new):
+    return diff_fields(old, new)
+
+
+def apply_metadata(old, delta):
+    return apply_fields(old, delta)
+
+
+def detection_keys(detections):
+    """
+    Unique key of each detection: (index, class_name, n). Detections of the
+    same object with multiple labels share the index, n counts repeated
+    (index, class_name) pairs.
+    """
+    counts = {}
+    keys = []
+    for d in detections:
+        key = (d.get("index"), d.get("class_name"))
+        n = counts.get(key, 0)
+        counts[key] = n + 1
+        keys.append(key + (n,))
+    return keys
+
+
+def diff_detections(old, new, score_tolerance=0):
+    """
+    Compare two lists of detections by their key, only the changed fields
+    of a detection are sent. The order of the new list is only sent if
+    applying the delta would not produce it.
+    """
+    old_keys = detection_keys(old)
+    new_keys = detection_keys(new)
+    old_by_key = dict(zip(old_keys, old))
+    new_key_set = set(new_keys)
+    added = []
+    changed = []
+    for key, d in zip(new_keys, new):
+        if key not in old_by_key:
+            added.append({"key": list(key), "detection": d})
+            continue
+        fields = diff_fields(old_by_key[key], d, score_tolerance)
+        if len(fields["changed"]) > 0 or len(fields["removed"]) > 0:
+            changed.append(dict(fields, key=list(key)))
+    removed = [list(k) for k in old_keys if k not in new_key_set]
+    delta = {"added": added, "changed": changed, "removed": removed}
+    order = [k for k in old_keys if k in new_key_set]
+    order += [k for k in new_keys if k not in old_by_key]
+    if order != new_keys:
+        delta["order"] = [list(k) for k in new_keys]
+    return delta
+
+
+def apply_detections(old, delta):
+    keys = detection_keys(old)
+    by_key = dict(zip(keys, copy.deepcopy(old)))
+    removed = set(tuple(k) for k in delta.get("removed", []))
+    order = [k for k in keys if k not in removed]
+    for a in delta.get("added", []):
+        key = tuple(a["key"])
+        by_key[key] = copy.deepcopy(a["detection"])
+        order.append(key)
+    for d in delta.get("changed", []):
+        key = tuple(d["key"])
+        by_key[key] = apply_fields(by_key[key], d)
+    if "order" in delta:
+        order = [tuple(k) for k in delta["order"]]
+    return [by_key[k] for k in order]
+
+
+def apply_delta(previous, encoded):
+    return {
+        "detections": {
+            detection_type: apply_detections(
+                previous["detections"][detection_type], encoded[detection_type]
+            )
+            for detection_type in DETECTION_TYPES
+        },
+        "metadata": apply_metadata(previous["metadata"], encoded["metadata"]),
+    }
+
+
+class DeltaEncoder:
+    """
+    Send a full message (keyframe) every keyframe_interval messages per node,
+    otherwise only the fields which changed since the previous message of the
+    node. Score changes up to score_tolerance are not sent. A keyframe is also
+    sent if it is not larger than the delta.
+
+    keyframe: {"type": "keyframe", "node_id", "seq", "message"}
+    delta: {"type": "delta", "node_id", "seq", "base_seq", "flowers", "pollinators", "metadata"}
+    """
+
+    def __init__(self, keyframe_interval=30, report_interval=300, score_tolerance=0.01):
+        self.keyframe_interval = keyframe_interval
+        self.report_interval = report_interval
+        self.score_tolerance = score_tolerance
+        self.sequences = {}  # node_id -> sequence number of the last message
+        # node_id -> last message as reconstructed by the receiver
+        self.last_messages = {}
+        self.since_keyframe = {}
+        self.full_bytes = {}
+        self.sent_bytes = {}
+        self.last_report_time = time.time()
+
+    def reset(self, node_id):
+        """
+        Send a keyframe next (e.g. if a message could not be delivered)
+        """
+        self.last_messages.pop(node_id, None)
+
+    def encode(self, node_id, message):
+        seq = self.sequences.get(node_id, -1) + 1
+        self.sequences[node_id] = seq
+        previous = self.last_messages.get(node_id)
+        keyframe = {
+            "type": "keyframe",
+            "node_id": node_id,
+            "seq": seq,
+            "message": message,
+        }
+        keyframe_size = len(json.dumps(keyframe))
+        encoded = None
+        if previous is not None and self.since_keyframe.get(node_id, 0) < (
+            self.keyframe_interval - 1
+        ):
+            delta = {
+                "type": "delta",
+                "node_id": node_id,
+                "seq": seq,
+                "base_seq": seq - 1,
+                "metadata": diff_metadata(previous["metadata"], message["metadata"]),
+            }
+            for detection_type in DETECTION_TYPES:
+                delta[detection_type] = diff_detections(
+                    previous["detections"][detection_type],
+                    message["detections"][detection_type],
+                    self.score_tolerance,
+                )
+            delta_size = len(json.dumps(delta))
+            if delta_size < keyframe_size:
+                encoded = delta
+                self.since_keyframe[node_id] += 1
+                self.last_messages[node_id] = apply_delta(previous, delta)
+                self._count(node_id, keyframe_size, delta_size)
+        if encoded is None:
+            encoded = keyframe
+            self.since_keyframe[node_id] = 0
+            self.last_messages[node_id] = copy.deepcopy(message)
+            self._count(node_id, keyframe_size, keyframe_size)
+        return encoded
+
+    def _count(self, node_id, full_bytes, sent_bytes):
+        self.full_bytes[node_id] = self.full_bytes.get(node_id, 0) + full_bytes
+        self.sent_bytes[node_id] = self.sent_bytes.get(node_id, 0) + sent_bytes
+        if time.time() - self.last_report_time >= self.report_interval:
+            self.log_report()
+
+    def get_report(self):
+        report = {}
+        for node_id in self.full_bytes.keys():
+            full_bytes = self.full_bytes[node_id]
+            sent_bytes = self.sent_bytes[node_id]
+            report[node_id] = {
+                "full_bytes": full_bytes,
+                "sent_bytes": sent_bytes,
+                "saved": round(1 - sent_bytes / full_bytes, 3) if full_bytes else 0,
+            }
+        return report
+
+    def log_report(self):
+        total_full = sum(self.full_bytes.values())
+        total_sent = sum(self.sent_bytes.values())
+        for node_id, node_report in self.get_report().items():
+            log.info(
+                "node {}: sent {} of {} bytes ({:.1%} saved)".format(
+                    node_id,
+                    node_report["sent_bytes"],
+                    node_report["full_bytes"],
+                    node_report["saved"],
+                )
+            )
+        if total_full > 0:
+            log.info(
+                "total: sent {} of {} bytes ({:.1%} saved)".format(
+                    total_sent, total_full, 1 - total_sent / total_full
+                )
+            )
+        self.last_report_time = time.time()
+
+
+class DeltaReconstructor:
+    """
+    Reference implementation for the receiver: rebuild the full messages
+    from keyframes and deltas.
+    """
+
+    def __init__(self):
+        self.sequences = {}
+        self.messages = {}
+
+    def apply(self, encoded):
+        """
+        Returns the full message, or None if the delta cannot be applied
+        (a message was lost, wait for the next keyframe)
+        """
+        node_id = encoded["node_id"]
+        if encoded["type"] == "keyframe":
+            message = encoded["message"]
+        elif self.sequences.get(node_id) != encoded["base_seq"]:
+            log.warning(
+                "Missing message {} of node {}, waiting for the next keyframe".format(
+                    encoded["base_seq"], node_id
+                )
+            )
+            return None
+        else:
+            message = apply_delta(self.messages[node_id], encoded)
+        self.sequences[node_id] = encoded["seq"]
+        self.messages[node_id] = message
+        return copy.deepcopy(message)
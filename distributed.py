@@ -0,0 +1,319 @@
+import base64
+import json
+import os
+import socket
+import sys
+import time
+import logging
+from collections import deque
+
+import zmq
+
+from inputs import InputImage
+
+log = logging.getLogger(__name__)
+log.propagate = False
+log.setLevel(logging.INFO)
+handler = logging.StreamHandler(stream=sys.stdout)
+handler.setFormatter(
+    logging.Formatter("%(asctime)s %(name)s %(levelname)s %(message)s")
+)
+log.addHandler(handler)
+
+
+class WorkerStats:
+    def __init__(self):
+        self.images = 0
+        self.processing_time = 0
+        self.last_seen = time.time()
+
+    def add(self, processing_time):
+        self.images += 1
+        self.processing_time += processing_time
+        self.last_seen = time.time()
+
+    def reset(self):
+        self.images = 0
+        self.processing_time = 0
+
+
+class Coordinator:
+    """
+    Hand out leased batches of images to workers and collect their results.
+
+    Requests of the workers (JSON):
+        {"type": "lease", "worker": ..., "max_items": n}
+            reply: {"type": "batch", "lease": id, "items": [{"id", "filename", "data"}]}
+                   or {"type": "empty"}
+        {"type": "result", "worker": ..., "lease": id, "id": id, "message": ..., "processing_time": s}
+            reply: {"type": "ack"}
+
+    get_item_fn() returns the next InputImage or None,
+    result_fn(item, message) is called with the result of a worker (None if failed or skipped),
+    done_fn(item) is called once an item is finished.
+    Items of leases which were not renewed within lease_timeout seconds
+    (each result renews the lease) are handed out again.
+    """
+
+    def __init__(
+        self,
+        port,
+        get_item_fn,
+        result_fn,
+        done_fn,
+        batch_size=8,
+        lease_timeout=300,
+        send_images=False,
+        stats_interval=60,
+    ):
+        self.get_item_fn = get_item_fn
+        self.result_fn = result_fn
+        self.done_fn = done_fn
+        self.batch_size = batch_size
+        self.lease_timeout = lease_timeout
+        self.send_images = send_images
+        self.stats_interval = stats_interval
+        self.context = zmq.Context().instance()
+        self.socket = self.context.socket(zmq.ROUTER)
+        self.socket.bind("tcp://*:{}".format(port))
+        log.info("Coordinator listening on tcp://*:{}".format(port))
+        self.items = {}  # id -> item, leased or waiting to be leased again
+        self.requeued = deque()
+        self.leases = {}  # lease id -> {"worker", "ids", "expires"}
+        self.next_item_id = 0
+        self.next_lease_id = 0
+        self.workers = {}
+        self.last_stats_time = time.time()
+
+    def _serialize(self, item_id, item):
+        data = item.data
+        if data is None and self.send_images:
+            with open(item.filename, "rb") as f:
+                data = f.read()
+        return {
+            "id": item_id,
+            "filename": item.filename,
+            "data": (
+                base64.b64encode(data).decode("utf-8") if data is not None else None
+            ),
+        }
+
+    def _next_ids(self, max_items):
+        ids = []
+        while len(ids) < max_items and len(self.requeued) > 0:
+            ids.append(self.requeued.popleft())
+        while len(ids) < max_items:
+            item = self.get_item_fn()
+            if item is None:
+                break
+            self.items[self.next_item_id] = item
+            ids.append(self.next_item_id)
+            self.next_item_id += 1
+        return ids
+
+    def _handle_lease(self, request):
+        worker = request.get("worker")
+        max_items = min(request.get("max_items", self.batch_size), self.batch_size)
+        ids = self._next_ids(max_items)
+        if len(ids) == 0:
+            return {"type": "empty"}
+        lease_id = self.next_lease_id
+        self.next_lease_id += 1
+        self.leases[lease_id] = {
+            "worker": worker,
+            "ids": set(ids),
+            "expires": time.time() + self.lease_timeout,
+        }
+        if worker not in self.workers:
+            log.info("New worker {}".format(worker))
+            self.workers[worker] = WorkerStats()
+        log.info("Lease {}: {} images to worker {}".format(lease_id, len(ids), worker))
+        return {
+            "type": "batch",
+            "lease": lease_id,
+            "items": [self._serialize(i, self.items[i]) for i in ids],
+        }
+
+    def _handle_result(self, request):
+        worker = request.get("worker")
+        item_id = request.get("id")
+        lease = self.leases.get(request.get("lease"))
+        if lease is not None:
+            lease["ids"].discard(item_id)
+            lease["expires"] = time.time() + self.lease_timeout
+            if len(lease["ids"]) == 0:
+                del self.leases[request.get("lease")]
+        if worker not in self.workers:
+            self.workers[worker] = WorkerStats()
+        self.workers[worker].add(request.get("processing_time", 0))
+        item = self.items.pop(item_id, None)
+        if item is None:
+            # already done, e.g. by another worker after the lease expired
+            return {"type": "ack"}
+        if item_id in self.requeued:
+            self.requeued.remove(item_id)
+        try:
+            self.result_fn(item, request.get("message"))
+        finally:
+            self.done_fn(item)
+        return {"type": "ack"}
+
+    def _expire_leases(self):
+        now = time.time()
+        for lease_id in list(self.leases.keys()):
+            lease = self.leases[lease_id]
+            if lease["expires"] > now:
+                continue
+            log.warning(
+                "Lease {} of worker {} expired, requeueing {} images".format(
+                    lease_id, lease["worker"], len(lease["ids"])
+                )
+            )
+            for item_id in sorted(lease["ids"]):
+                if item_id in self.items:
+                    self.requeued.append(item_id)
+            del self.leases[lease_id]
+
+    def poll(self, timeout=1000):
+        """
+        Handle at most one request, waiting up to timeout ms
+        """
+        if (self.socket.poll(timeout) & zmq.POLLIN) != 0:
+            identity, empty, payload = self.socket.recv_multipart()
+            try:
+                request = json.loads(payload)
+                if request.get("type") == "lease":
+                    reply = self._handle_lease(request)
+                elif request.get("type") == "result":
+                    reply = self._handle_result(request)
+                else:
+                    reply = {"type": "error", "error": "unknown request"}
+            except Exception as e:
+                log.error("Error handling request: {}".format(e))
+                reply = {"type": "error", "error": str(e)}
+            self.socket.send_multipart([identity, empty, json.dumps(reply).encode()])
+        self._expire_leases()
+        if time.time() - self.last_stats_time >= self.stats_interval:
+            self.log_stats()
+
+    def pending(self):
+        return len(self.items)
+
+    def log_stats(self):
+        """
+        Log the throughput per worker since the last call
+        """
+        interval = time.time() - self.last_stats_time
+        for worker, stats in self.workers.items():
+            log.info(
+                "worker {}: {} images, {:.2f} images/s, {:.2f} s per image, last seen {:.0f} s ago".format(
+                    worker,
+                    stats.images,
+                    stats.images / interval,
+                    stats.processing_time / stats.images if stats.images > 0 else 0,
+                    time.time() - stats.last_seen,
+                )
+            )
+            stats.reset()
+        log.info(
+            "{} images outstanding, {} active leases".format(
+                self.pending(), len(self.leases)
+            )
+        )
+        self.last_stats_time = time.time()
+
+
+class CoordinatorClient:
+    """
+    Input of a worker: lease batches of images from the coordinator and report the results
+    """
+
+    def __init__(
+        self, host, port, batch_size=8, timeout=3000, retries=10, worker_id=None
+    ):
+        self.host = host
+        self.port = port
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.retries = retries
+        if worker_id is None:
+            worker_id = "{}-{}".format(socket.gethostname(), os.getpid())
+        self.worker_id = worker_id
+        self.context = zmq.Context().instance()
+        self.client = None
+        self._connect()
+        self.queue = deque()
+
+    def _connect(self):
+        self.client = self.context.socket(zmq.REQ)
+        self.client.connect("tcp://{}:{}".format(self.host, self.port))
+        log.info(
+            "Worker {} connecting to tcp://{}:{}".format(
+                self.worker_id, self.host, self.port
+            )
+        )
+
+    def _request(self, request):
+        payload = json.dumps(request).encode()
+        self.client.send(payload)
+        retries_left = self.retries
+        while True:
+            if (self.client.poll(self.timeout) & zmq.POLLIN) != 0:
+                return json.loads(self.client.recv())
+            retries_left -= 1
+            log.warning("No response from coordinator")
+            self.client.setsockopt(zmq.LINGER, 0)
+            self.client.close()
+            if retries_left == 0:
+                log.error("Coordinator could not be reached, abandoning")
+                exit(1)
+            log.info(
+                "Reconnecting to coordinator… {} retries left".format(retries_left)
+            )
+            self._connect()
+            self.client.send(payload)
+
+    def get_next(self):
+        """
+        Get the next image, leases a new batch if necessary
+        """
+        if len(self.queue) == 0:
+            reply = self._request(
+                {
+                    "type": "lease",
+                    "worker": self.worker_id,
+                    "max_items": self.batch_size,
+                }
+            )
+            if reply.get("type") != "batch":
+                return None
+            for i in reply.get("items"):
+                data = i.get("data")
+                if data is not None:
+                    data = base64.b64decode(data)
+                self.queue.append(
+                    InputImage(
+                        i.get("filename"),
+                        data=data,
+                        source=reply.get("lease"),
+                        position=i.get("id"),
+                    )
+                )
+        if len(self.queue) == 0:
+            return None
+        return self.queue.popleft()
+
+    def report(self, item, message, processing_time):
+        """
+        Send the result of an image (None if failed or skipped) to the coordinator
+        """
+        self._request(
+            {
+                "type": "result",
+                "worker": self.worker_id,
+                "lease": item.source,
+                "id": item.position,
+                "message": message,
+                "processing_time": round(processing_time, 3),
+            }
+        )
@@ -0,0 +1,56 @@
+class FlowerGate:
+    """
+    Decide which flowers get the pollinator pass.
+
+    Flowers are skipped if their class is not in classes, their score is below
+    min_score, the smaller side of the crop is below min_crop_size (in pixel),
+    or if they are not among the top_k remaining flowers by score.
+    """
+
+    def __init__(self, min_score=None, min_crop_size=None, classes=None, top_k=None):
+        self.min_score = min_score
+        self.min_crop_size = min_crop_size
+        self.classes = classes
+        self.top_k = top_k
+
+    def is_enabled(self):
+        return (
+            self.min_score is not None
+            or self.min_crop_size is not None
+            or self.classes is not None
+            or self.top_k is not None
+        )
+
+    def select(self, names, scores, crop_sizes):
+        """
+        crop_sizes: list of (width, height)
+        Returns the reason for skipping each flower, None if it passes
+        """
+        reasons = [None for i in range(len(names))]
+        for i in range(len(names)):
+            if self.classes is not None and names[i] not in self.classes:
+                reasons[i] = "class"
+            elif self.min_score is not None and scores[i] < self.min_score:
+                reasons[i] = "score"
+            elif (
+                self.min_crop_size is not None
+                and min(crop_sizes[i]) < self.min_crop_size
+            ):
+                reasons[i] = "size"
+        if self.top_k is not None:
+            passed = [i for i in range(len(names)) if reasons[i] is None]
+            passed.sort(key=lambda i: scores[i], reverse=True)
+            for i in passed[self.top_k :]:
+                reasons[i] = "top_k"
+        return reasons
+
+
+def create_flower_gate(gating_config):
+    if gating_config is None:
+        gating_config = {}
+    return FlowerGate(
+        min_score=gating_config.get("min_flower_score"),
+        min_crop_size=gating_config.get("min_crop_size"),
+        classes=gating_config.get("classes"),
+        top_k=gating_config.get("top_k"),
+    )
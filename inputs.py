@@ -1,7 +1,14 @@
 import zmq
 import os
+import json
+import base64
+import tarfile
+import zipfile
 import logging
 import sys
+from dataclasses import dataclass
+from io import BytesIO
+from PIL import Image
 
 log = logging.getLogger(__name__)
 log.propagate = False
@@ -13,6 +20,38 @@ handler.setFormatter(
 log.addHandler(handler)
 
 
+@dataclass(eq=False)
+class InputImage:
+    """
+    An image to process, either a file or encoded image data (e.g. an archive member)
+    """
+
+    filename: str
+    data: bytes = None
+    source: str = None  # e.g. the archive the image was read from
+    position: int = None  # e.g. the offset of the member in the archive
+    future: object = None
+
+    def is_file(self):
+        return self.data is None
+
+    def open(self):
+        if self.data is not None:
+            img = Image.open(BytesIO(self.data))
+        else:
+            img = Image.open(self.filename)
+        img.load()
+        return img
+
+    def decode_async(self, executor):
+        self.future = executor.submit(self.open)
+
+    def get_image(self):
+        if self.future is not None:
+            return self.future.result()
+        return self.open()
+
+
 class ZMQClient:
     def __init__(self, host, port, timeout=3000, retries=20):
         self.host = host
@@ -36,6 +75,7 @@ class ZMQClient:
             response codes:
                 0: no data available
                 1: first message removed from queue
+        a second frame in the reply is added to the message as "data"
         """
         log.info("Sending request code {}".format(code))
 
@@ -43,7 +83,10 @@ class ZMQClient:
         retries_left = self.retries
         while True:
             if (self.client.poll(self.timeout) & zmq.POLLIN) != 0:
-                reply = self.client.recv_json()
+                frames = self.client.recv_multipart()
+                reply = json.loads(frames[0])
+                if len(frames) > 1 and type(reply) == dict:
+                    reply["data"] = frames[1]
 
                 # print("Server replied (%s)", type(reply))
                 return reply
@@ -72,6 +115,52 @@ class ZMQClient:
         self.context.term()
 
 
+def read_shared_memory(name, size=None, unlink=False):
+    """
+    Copy the content of a POSIX shared memory segment
+    """
+    from multiprocessing import shared_memory
+
+    try:
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # python < 3.13 always registers the segment with the resource tracker,
+        # which would remove it when this process exits. unlink() unregisters
+        # it again, so it must only be unregistered here if it is kept.
+        from multiprocessing import resource_tracker
+
+        shm = shared_memory.SharedMemory(name=name)
+        if not unlink:
+            resource_tracker.unregister(shm._name, "shared_memory")
+    try:
+        if size is None:
+            size = shm.size
+        data = bytes(shm.buf[:size])
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+    return data
+
+
+def get_message_data(msg):
+    """
+    Returns the encoded image of a message queue reply, or None if only a filename was sent.
+
+    The image can be sent as second frame ("data"), base64 encoded ("image")
+    or as the name of a shared memory segment ("shm_name", "shm_size", "shm_unlink")
+    """
+    if msg.get("data") is not None:
+        return msg.get("data")
+    if msg.get("image") is not None:
+        return base64.b64decode(msg.get("image"))
+    if msg.get("shm_name") is not None:
+        return read_shared_memory(
+            msg.get("shm_name"), msg.get("shm_size"), msg.get("shm_unlink", False)
+        )
+    return None
+
+
 class DirectoryInput:
     """
     Load images from a local directory
@@ -81,6 +170,7 @@ class DirectoryInput:
         self.path = path
         self.format = format
         self.files = []
+        self.seen = set()
         self.index = 0
 
     def scan(self):
@@ -94,20 +184,218 @@ class DirectoryInput:
                 if f.endswith(self.format):
                     # yield os.path.join(dir_path, f)
                     abs_fpath = os.path.join(dir_path, f)
-                    if abs_fpath not in self.files:
+                    if abs_fpath not in self.seen:
                         unseen_files.append(abs_fpath)
         unseen_files.sort(key=lambda x: os.path.getmtime(x))
         print("adding {} new files".format(len(unseen_files)))
         self.files += unseen_files
+        self.seen.update(unseen_files)
 
-    def get_next(self):
+    def pending(self):
         """
-        Get the next image in the directory
+        Number of files found which were not returned yet
         """
-        if self.index >= len(self.files):
+        return len(self.files) - self.index
+
+    def get_next(self, scan=True):
+        """
+        Get the next image in the directory, scans for new images once all
+        were returned (unless scan is False)
+        """
+        if scan and self.index >= len(self.files):
             self.scan()
         if self.index >= len(self.files):
             return None
         self.index += 1
         return self.files[self.index - 1]
 
+
+class ArchiveInput:
+    """
+    Stream images from tar or zip archives without extracting them.
+
+    Progress is stored per archive as the offset of the first member which is
+    not done yet, an interrupted run resumes from there.
+    """
+
+    def __init__(
+        self, paths, format="jpg", checkpoint_file=None, checkpoint_interval=10
+    ):
+        if isinstance(paths, str):
+            paths = [paths]
+        self.paths = [os.path.abspath(p) for p in paths]
+        self.format = format
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint = {}  # archive path -> {"offset": int, "finished": bool}
+        self.outstanding = {}  # archive path -> offsets of members not done yet
+        self.next_offset = {}  # archive path -> offset of the next member to read
+        self.completed_since_checkpoint = 0
+        self.load_checkpoint()
+        self.sizes = {}
+        # archive path -> bytes left to read when starting (the checkpoint offset
+        # of compressed archives is in the decompressed stream, close enough)
+        self.unread_bytes = {}
+        for path in self.paths:
+            checkpoint = self.checkpoint.get(path, {})
+            self.sizes[path] = os.path.getsize(path)
+            if checkpoint.get("finished", False):
+                self.unread_bytes[path] = 0
+            else:
+                self.unread_bytes[path] = self.sizes[path] - (
+                    checkpoint.get("offset") or 0
+                )
+        # archive path -> position in the archive of the first member read and
+        # of the end of the last member read (in bytes of the archive file)
+        self.start_positions = {}
+        self.positions = {}
+        self.images_read = 0
+        self.members = self._iter_members()
+
+    def load_checkpoint(self):
+        if self.checkpoint_file is None or not os.path.exists(self.checkpoint_file):
+            return
+        with open(self.checkpoint_file, "r") as f:
+            self.checkpoint = json.load(f)
+        log.info("Loaded checkpoint {}".format(self.checkpoint_file))
+
+    def save_checkpoint(self):
+        if self.checkpoint_file is None:
+            return
+        for path in self.next_offset.keys():
+            if len(self.outstanding[path]) > 0:
+                offset = min(self.outstanding[path])
+            else:
+                offset = self.next_offset[path]
+            finished = (
+                self.next_offset[path] is None and len(self.outstanding[path]) == 0
+            )
+            self.checkpoint[path] = {"offset": offset, "finished": finished}
+        tmp_file = self.checkpoint_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(self.checkpoint, f)
+        os.replace(tmp_file, self.checkpoint_file)
+        self.completed_since_checkpoint = 0
+
+    def _iter_tar(self, path, start_offset):
+        with open(path, "rb") as f:
+            try:
+                # uncompressed archives: seek directly to the checkpoint
+                tar = tarfile.open(fileobj=f, mode="r:")
+                f.seek(start_offset)
+                tar = tarfile.open(fileobj=f, mode="r:")
+                compressed = False
+            except tarfile.ReadError:
+                # compressed archives have to be read from the start
+                f.seek(0)
+                tar = tarfile.open(fileobj=f, mode="r|*")
+                compressed = True
+            while True:
+                member = tar.next()
+                if member is None:
+                    break
+                tar.members = []  # do not keep every member in memory
+                if member.offset < start_offset or not member.isfile():
+                    continue
+                if not member.name.endswith(self.format):
+                    continue
+                data = tar.extractfile(member).read()
+                ratio = 1
+                if compressed:
+                    # f.tell() runs ahead of the members read by up to a
+                    # compressed block, convert the offsets in the
+                    # decompressed stream with the compression ratio so far
+                    decompressed = tar.fileobj.pos + len(
+                        getattr(tar.fileobj, "dbuf", b"")
+                    )
+                    ratio = f.tell() / max(decompressed, 1)
+                # tar.offset is the position of the next header
+                yield (
+                    member.offset,
+                    tar.offset,
+                    member.offset * ratio,
+                    tar.offset * ratio,
+                    member.name,
+                    data,
+                )
+
+    def _iter_zip(self, path, start_offset):
+        with zipfile.ZipFile(path) as zf:
+            infos = sorted(zf.infolist(), key=lambda i: i.header_offset)
+            # the members end at the central directory
+            self.sizes[path] = zf.start_dir
+            ends = [i.header_offset for i in infos[1:]] + [zf.start_dir]
+            for info, end in zip(infos, ends):
+                if info.header_offset < start_offset or info.is_dir():
+                    continue
+                if not info.filename.endswith(self.format):
+                    continue
+                yield (
+                    info.header_offset,
+                    info.header_offset + 1,
+                    info.header_offset,
+                    end,
+                    info.filename,
+                    zf.read(info),
+                )
+
+    def _iter_members(self):
+        for path in self.paths:
+            checkpoint = self.checkpoint.get(path, {})
+            if checkpoint.get("finished", False):
+                log.info("Skipping finished archive {}".format(path))
+                continue
+            start_offset = checkpoint.get("offset") or 0
+            log.info("Reading archive {} from offset {}".format(path, start_offset))
+            self.outstanding[path] = set()
+            self.next_offset[path] = start_offset
+            if zipfile.is_zipfile(path):
+                members = self._iter_zip(path, start_offset)
+            else:
+                members = self._iter_tar(path, start_offset)
+            for offset, next_offset, start, end, name, data in members:
+                self.outstanding[path].add(offset)
+                self.next_offset[path] = next_offset
+                if path not in self.start_positions:
+                    self.start_positions[path] = start
+                self.positions[path] = end
+                self.images_read += 1
+                yield InputImage(name, data=data, source=path, position=offset)
+            self.next_offset[path] = None
+            self.start_positions.setdefault(path, self.sizes[path])
+            self.positions[path] = self.sizes[path]
+            self.save_checkpoint()
+
+    def get_next(self):
+        """
+        Get the next image from the archives
+        """
+        return next(self.members, None)
+
+    def get_remaining(self):
+        """
+        Estimated number of images left in the archives, extrapolated from
+        the number of images in the bytes read so far
+        """
+        bytes_read = 0
+        bytes_left = 0
+        for path, unread_bytes in self.unread_bytes.items():
+            if path in self.positions:
+                bytes_read += self.positions[path] - self.start_positions[path]
+                bytes_left += max(0, self.sizes[path] - self.positions[path])
+            else:
+                bytes_left += unread_bytes
+        if bytes_read <= 0:
+            return 0
+        return int(self.images_read * bytes_left / bytes_read)
+
+    def mark_done(self, item):
+        if item.source not in self.outstanding:
+            return
+        self.outstanding[item.source].discard(item.position)
+        self.completed_since_checkpoint += 1
+        if (
+            self.completed_since_checkpoint >= self.checkpoint_interval
+            or self.next_offset[item.source] is None
+        ):
+            self.save_checkpoint()
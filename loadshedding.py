@@ -0,0 +1,137 @@
+import sys
+import time
+import logging
+
+log = logging.getLogger(__name__)
+log.propagate = False
+log.setLevel(logging.INFO)
+handler = logging.StreamHandler(stream=sys.stdout)
+handler.setFormatter(
+    logging.Formatter("%(asctime)s %(name)s %(levelname)s %(message)s")
+)
+log.addHandler(handler)
+
+LEVEL_SETTINGS = ["augment", "image_size", "max_det", "skip_crops", "sample_every"]
+POSITIVE_SETTINGS = ["image_size", "max_det", "sample_every"]
+
+
+class LoadShedder:
+    """
+    Step through degradation levels while the backlog or the latency is too high.
+
+    The settings of the levels are cumulative: level 2 applies the settings of
+    level 1 and level 2. The level is raised at most every step_interval seconds
+    while the backlog exceeds max_backlog or the latency exceeds max_latency,
+    and lowered once both stayed below resume_ratio * limit for recovery_time seconds.
+    """
+
+    def __init__(
+        self,
+        levels,
+        max_backlog=None,
+        max_latency=None,
+        resume_ratio=0.5,
+        step_interval=30,
+        recovery_time=60,
+        smoothing=0.2,
+    ):
+        for level in levels:
+            for key, value in level.items():
+                if key not in LEVEL_SETTINGS:
+                    raise ValueError(
+                        "Unknown load shedding setting {}, use one of {}".format(
+                            key, LEVEL_SETTINGS
+                        )
+                    )
+                if key in POSITIVE_SETTINGS and (type(value) is not int or value < 1):
+                    raise ValueError(
+                        "Load shedding setting {} must be a positive integer, got {}".format(
+                            key, value
+                        )
+                    )
+        self.levels = levels
+        self.max_backlog = max_backlog
+        self.max_latency = max_latency
+        self.resume_ratio = resume_ratio
+        self.step_interval = step_interval
+        self.recovery_time = recovery_time
+        self.smoothing = smoothing
+        self.level = 0
+        self.latency = None
+        self.last_change = 0
+        self.below_since = None
+        self.frame_counters = {}
+
+    def _overloaded(self, backlog):
+        if self.max_backlog is not None and backlog > self.max_backlog:
+            return True
+        if self.max_latency is not None and self.latency is not None:
+            return self.latency > self.max_latency
+        return False
+
+    def _recovered(self, backlog):
+        if self.max_backlog is not None:
+            if backlog > self.max_backlog * self.resume_ratio:
+                return False
+        if self.max_latency is not None and self.latency is not None:
+            if self.latency > self.max_latency * self.resume_ratio:
+                return False
+        return True
+
+    def update(self, backlog, latency=None):
+        """
+        Update with the current backlog and the latency of the last image,
+        returns the current level
+        """
+        now = time.time()
+        if latency is not None:
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += self.smoothing * (latency - self.latency)
+        if self._overloaded(backlog):
+            self.below_since = None
+            if (
+                self.level < len(self.levels)
+                and now - self.last_change >= self.step_interval
+            ):
+                self._set_level(self.level + 1, backlog, now)
+        elif self._recovered(backlog):
+            if self.below_since is None:
+                self.below_since = now
+            if self.level > 0 and now - self.below_since >= self.recovery_time:
+                self._set_level(self.level - 1, backlog, now)
+                self.below_since = now
+        else:
+            self.below_since = None
+        return self.level
+
+    def _set_level(self, level, backlog, now):
+        log.warning(
+            "Load shedding level {} -> {} (backlog {}, latency {})".format(
+                self.level,
+                level,
+                backlog,
+                round(self.latency, 3) if self.latency is not None else None,
+            )
+        )
+        self.level = level
+        self.last_change = now
+
+    def get_settings(self):
+        settings = {}
+        for level in self.levels[: self.level]:
+            settings.update(level)
+        return settings
+
+    def should_skip(self, node_id):
+        """
+        Returns True if the frame should be dropped (only every k-th frame per node is processed)
+        """
+        sample_every = self.get_settings().get("sample_every", 1)
+        count = self.frame_counters.get(node_id, 0)
+        self.frame_counters[node_id] = count + 1
+        return count % sample_every != 0
+
+    def get_metadata(self):
+        return {"level": self.level, "settings": self.get_settings()}
@@ -12,6 +12,7 @@ log.addHandler(handler)
 
 logging.basicConfig(level=logging.INFO)
 import time
+import datetime
 import os
 from PIL import Image
 import base64
@@ -19,14 +20,56 @@ import yaml
 import json
 
 import argparse
+import torch
 from yolomodelhelper import YoloModel
 from messagehelper import MessageGenerator, Flower, Pollinator, MQTTClient, HTTPClient
-from inputs import ZMQClient, DirectoryInput
+from inputs import (
+    ZMQClient,
+    DirectoryInput,
+    ArchiveInput,
+    InputImage,
+    get_message_data,
+)
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from scheduler import NodeScheduler, get_node_id
+from profiling import PipelineProfiler, profile_region
+from reloader import ModelReloader
+from cropencoder import CropEncoder
+from loadshedding import LoadShedder
+from gating import create_flower_gate
+from regions import create_region_planner, assign_to_regions
+from deltaencoder import DeltaEncoder
+from distributed import Coordinator, CoordinatorClient
+from autotune import (
+    Autotuner,
+    get_default_thread_candidates,
+    get_profile_path,
+    load_profile,
+    save_profile,
+)
 import socket
 from tqdm import tqdm
 
 argparser = argparse.ArgumentParser(description="Pollinator Inference")
 argparser.add_argument("--config", type=str, default="config.yaml", help="config file")
+argparser.add_argument(
+    "--autotune",
+    action="store_true",
+    help="run a calibration sweep, store the best settings in the host profile and exit",
+)
+argparser.add_argument(
+    "--profile",
+    type=int,
+    metavar="N",
+    help="process N images under the profilers, write the results and exit",
+)
+argparser.add_argument(
+    "--profile-dir",
+    type=str,
+    default="profile",
+    help="output directory for --profile",
+)
 args = argparser.parse_args()
 # parse yaml configuration file
 with open(args.config, "r") as stream:
@@ -38,49 +81,118 @@ with open(args.config, "r") as stream:
 
 HOSTNAME = socket.gethostname()
 
+# Distributed inference: a coordinator leases batches of images to workers on other hosts
+distributed_config = cfg.get("distributed") or {}
+ROLE = distributed_config.get("role", "standalone")
+if ROLE not in ["standalone", "coordinator", "worker"]:
+    log.error("Unknown role {}, use standalone, coordinator or worker".format(ROLE))
+    exit(1)
+if ROLE == "coordinator" and (args.autotune or args.profile is not None):
+    log.error(
+        "The coordinator does not run the models, use --autotune or --profile on a worker"
+    )
+    exit(1)
+DISTRIBUTED_PORT = distributed_config.get("port", 5560)
+DISTRIBUTED_BATCH_SIZE = distributed_config.get("batch_size", 8)
+
 
-# Flower Model configuration
-model_flower_config = cfg.get("models").get("flower")
-MODEL_FLOWER_WEIGHTS = model_flower_config.get("weights_path")
-MODEL_FLOWER_CLASS_NAMES = model_flower_config.get("class_names")
-MODEL_FLOWER_CONFIDENCE_THRESHOLD = model_flower_config.get("confidence_threshold")
-MODEL_FLOWER_IOU_THRESHOLD = model_flower_config.get("iou_threshold")
-MODEL_FLOWER_MARGIN = model_flower_config.get("margin")
-MODEL_FLOWER_MULTI_LABEL = model_flower_config.get("multi_label")
-MODEL_FLOWER_MULTI_LABEL_IOU_THRESHOLD = model_flower_config.get(
-    "multi_label_iou_threshold"
-)
-MODEL_FLOWER_MAX_DETECTIONS = model_flower_config.get("max_detections")
-MODEL_FLOWER_AUGMENT = model_flower_config.get("augment", False)
-MODEL_FLOWER_IMG_SIZE = model_flower_config.get("image_size")
+# Model configuration
+models_config = cfg.get("models")
 
 
-model_pollinator_config = cfg.get("models").get("pollinator")
-MODEL_POLLINATOR_WEIGHTS = model_pollinator_config.get("weights_path")
-MODEL_POLLINATOR_CLASS_NAMES = model_pollinator_config.get("class_names")
-MODEL_POLLINATOR_IMG_SIZE = model_pollinator_config.get("image_size")
-MODEL_POLLINATOR_CONFIDENCE_THRESHOLD = model_pollinator_config.get(
-    "confidence_threshold"
-)
-MODEL_POLLINATOR_IOU_THRESHOLD = model_pollinator_config.get("iou_threshold")
-MODEL_POLLINATOR_MARGIN = model_pollinator_config.get("margin")
-MODEL_POLLINATOR_AUGMENT = model_pollinator_config.get("augment", False)
-MODEL_POLLINATOR_MAX_DETECTIONS = model_pollinator_config.get("max_detections")
-MODEL_POLLINATOR_MULTI_LABEL = model_pollinator_config.get("multi_label")
-MODEL_POLLINATOR_MULTI_LABEL_IOU_THRESHOLD = model_pollinator_config.get(
-    "multi_label_iou_threshold"
-)
+def create_model(model_config):
+    return YoloModel(
+        model_config.get("weights_path"),
+        image_size=model_config.get("image_size"),
+        confidence_threshold=model_config.get("confidence_threshold"),
+        iou_threshold=model_config.get("iou_threshold"),
+        margin=model_config.get("margin"),
+        class_names=model_config.get("class_names"),
+        multi_label=model_config.get("multi_label"),
+        multi_label_iou_threshold=model_config.get("multi_label_iou_threshold"),
+        augment=model_config.get("augment", False),
+        max_det=model_config.get("max_detections"),
+        version=model_config.get("version"),
+    )
+
+
+# Performance Configuration
+# defaults < per-host profile (written by --autotune) < values set in the config file
+performance_config = cfg.get("performance") or {}
+PROFILE_DIR = performance_config.get("profile_dir", "profiles")
+PROFILE_PATH = get_profile_path(PROFILE_DIR, HOSTNAME)
+performance_settings = {
+    "torch_threads": None,
+    "pollinator_batch_size": 1,
+    "decode_workers": 0,
+    "crop_encoding_workers": 2,
+}
+if not args.autotune:
+    profile = load_profile(PROFILE_PATH)
+    if profile is not None:
+        log.info("Loaded performance profile {}".format(PROFILE_PATH))
+        performance_settings.update(profile.get("settings"))
+for key in performance_settings.keys():
+    if performance_config.get(key) is not None:
+        performance_settings[key] = performance_config.get(key)
+POLLINATOR_BATCH_SIZE = 1
+
 
+def apply_performance_settings(settings):
+    global POLLINATOR_BATCH_SIZE
+    if settings.get("torch_threads") is not None:
+        torch.set_num_threads(int(settings.get("torch_threads")))
+    POLLINATOR_BATCH_SIZE = max(1, int(settings.get("pollinator_batch_size", 1)))
+    log.info(
+        "torch threads: {}, pollinator batch size: {}".format(
+            torch.get_num_threads(), POLLINATOR_BATCH_SIZE
+        )
+    )
+
+
+apply_performance_settings(performance_settings)
+
+
+def set_decode_workers(workers):
+    """
+    Decode the next images in the background while the current image is processed
+    """
+    global DECODE_WORKERS, decode_pool
+    DECODE_WORKERS = int(workers or 0)
+    if decode_pool is not None:
+        decode_pool.shutdown()
+    decode_pool = None
+    if DECODE_WORKERS > 0 and ROLE != "coordinator":
+        decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS)
+
+
+decode_pool = None
+set_decode_workers(performance_settings.get("decode_workers"))
+decode_queue = deque()
 
 # Input Configuration
-input_config = cfg.get("input")
+input_config = cfg.get("input") or {}
 INPUT_TYPE = input_config.get("type")
+if ROLE == "worker":
+    INPUT_TYPE = "coordinator"
 if INPUT_TYPE is None:
     log.error("Input type not specified")
     exit(1)
 zmq_client = None
 dir_input = None
-if INPUT_TYPE == "message_queue":
+archive_input = None
+coordinator_client = None
+if INPUT_TYPE == "coordinator":
+    # Worker: images are leased from the coordinator
+    coordinator_client = CoordinatorClient(
+        distributed_config.get("coordinator_host", "localhost"),
+        DISTRIBUTED_PORT,
+        batch_size=DISTRIBUTED_BATCH_SIZE,
+        timeout=distributed_config.get("request_timeout", 3000),
+        retries=distributed_config.get("request_retries", 10),
+        worker_id=distributed_config.get("worker_id"),
+    )
+elif INPUT_TYPE == "message_queue":
     # ZMQ Input Configuration
     zmq_config = input_config.get("message_queue")
 
@@ -89,6 +201,18 @@ if INPUT_TYPE == "message_queue":
     ZMQ_REQ_TIMEOUT = zmq_config.get("request_timeout", 3000)
     ZMQ_REQ_RETRIES = zmq_config.get("request_retries", 10)
     zmq_client = ZMQClient(ZMQ_HOST, ZMQ_PORT, ZMQ_REQ_TIMEOUT, ZMQ_REQ_RETRIES)
+elif INPUT_TYPE == "archive":
+    # Archive Input Configuration
+    archive_config = input_config.get("archive")
+    if archive_config is None:
+        log.error("Archive input configuration is missing")
+        exit(1)
+    archive_input = ArchiveInput(
+        archive_config.get("paths"),
+        archive_config.get("extension", ".jpg"),
+        checkpoint_file=archive_config.get("checkpoint_file"),
+        checkpoint_interval=archive_config.get("checkpoint_interval", 10),
+    )
 else:
     # Directory Input Configuration
     directory_config = input_config.get("directory")
@@ -100,12 +224,55 @@ else:
     dir_input = DirectoryInput(INPUT_DIRECTORY_BASE_DIR, INPUT_DIRECTORY_EXTENSION)
     dir_input.scan()
 
+# Scheduling across camera nodes
+scheduling_config = input_config.get("scheduling") or {}
+SCHEDULER_MAX_PENDING = scheduling_config.get("max_pending", 1)
+SCHEDULER_REFILL_INTERVAL = scheduling_config.get("refill_interval", 10)
+SCHEDULER_SCAN_INTERVAL = scheduling_config.get("scan_interval", 60)
+try:
+    scheduler = NodeScheduler(
+        policy=scheduling_config.get("policy", "fifo"),
+        weights=scheduling_config.get("weights"),
+        latency_targets=scheduling_config.get("latency_targets"),
+        default_weight=scheduling_config.get("default_weight", 1),
+        default_latency_target=scheduling_config.get("default_latency_target", 600),
+        stats_interval=scheduling_config.get("stats_interval", 60),
+    )
+except ValueError as e:
+    log.error(e)
+    exit(1)
+log.info(
+    "Scheduling policy: {}, max pending: {}".format(
+        scheduler.policy, SCHEDULER_MAX_PENDING
+    )
+)
+last_refill_time = 0
+last_scan_time = 0
+
+# Load shedding when the backlog exceeds the capacity
+load_shedding_config = cfg.get("load_shedding") or {}
+load_shedder = None
+if load_shedding_config.get("enabled", False):
+    try:
+        load_shedder = LoadShedder(
+            load_shedding_config.get("levels", []),
+            max_backlog=load_shedding_config.get("max_backlog"),
+            max_latency=load_shedding_config.get("max_latency"),
+            resume_ratio=load_shedding_config.get("resume_ratio", 0.5),
+            step_interval=load_shedding_config.get("step_interval", 30),
+            recovery_time=load_shedding_config.get("recovery_time", 60),
+        )
+    except ValueError as e:
+        log.error(e)
+        exit(1)
+    log.info("Load shedding enabled with {} levels".format(len(load_shedder.levels)))
+
 REMOVE_FILES_AFTER_PROCESSING = input_config.get("remove_after_processing", False)
 if REMOVE_FILES_AFTER_PROCESSING:
     log.warning("Removing files after processing")
 
 # Output Configuration
-output_config = cfg.get("output")
+output_config = cfg.get("output") or {}
 IGNORE_EMPTY_RESULTS = output_config.get("ignore_empty_results", False)
 # Output Configuration (File)
 STORE_FILE = False
@@ -120,6 +287,21 @@ if output_config.get("file") is not None:
         log.info("store_file is enabled, base_dir: {}".format(BASE_DIR))
 
 
+# Output configuration (Crop encoding)
+crop_encoding_config = output_config.get("crop_encoding") or {}
+if crop_encoding_config.get("workers") is not None:
+    performance_settings["crop_encoding_workers"] = crop_encoding_config.get("workers")
+try:
+    crop_encoder = CropEncoder(
+        quality=crop_encoding_config.get("quality", 75),
+        max_dimension=crop_encoding_config.get("max_dimension"),
+        workers=performance_settings.get("crop_encoding_workers"),
+        encoder=crop_encoding_config.get("encoder"),
+    )
+except ValueError as e:
+    log.error(e)
+    exit(1)
+
 # Output configuration (MQTT)
 TRANSMIT_MQTT = False
 mclient = None
@@ -164,8 +346,28 @@ if output_config.get("http") is not None:
         )
         hclient = HTTPClient(http_url, http_username, http_password, http_method)
 
+# Output configuration (Delta transmission for HTTP and MQTT)
+delta_encoder = None
+output_config_delta = output_config.get("delta") or {}
+if output_config_delta.get("enabled", False):
+    delta_encoder = DeltaEncoder(
+        keyframe_interval=output_config_delta.get("keyframe_interval", 30),
+        report_interval=output_config_delta.get("report_interval", 300),
+        score_tolerance=output_config_delta.get("score_tolerance", 0.01),
+    )
+    log.info(
+        "Transmitting deltas, keyframe every {} messages".format(
+            delta_encoder.keyframe_interval
+        )
+    )
+
+# crops are only encoded if an output uses them, the outputs of a worker run on the coordinator
+ENCODE_CROPS = (
+    (STORE_FILE and SAVE_CROPS) or TRANSMIT_HTTP or TRANSMIT_MQTT or ROLE == "worker"
+)
+
 
-def get_filename():
+def request_input(scan=True):
     if INPUT_TYPE == "message_queue":
         msg = zmq_client.request_message(1)
         if type(msg) == dict:
@@ -173,143 +375,578 @@ def get_filename():
             if filename is None:
                 log.error("No filename found in message")
                 return None
-            return filename
+            try:
+                data = get_message_data(msg)
+            except Exception as e:
+                log.error("Could not read image data of {}: {}".format(filename, e))
+                return None
+            return InputImage(filename, data=data)
         elif type(msg) == int:
             if msg == 0:  # no data available
                 return None
             else:
                 log.info("Got message with code %d", msg)
                 return None
+    elif INPUT_TYPE == "archive":
+        return archive_input.get_next()
+    elif INPUT_TYPE == "coordinator":
+        return coordinator_client.get_next()
     else:
-        return dir_input.get_next()
-
-
-# Init Flower Model
-flower_model = YoloModel(
-    MODEL_FLOWER_WEIGHTS,
-    image_size=MODEL_FLOWER_IMG_SIZE,
-    confidence_threshold=MODEL_FLOWER_CONFIDENCE_THRESHOLD,
-    iou_threshold=MODEL_FLOWER_IOU_THRESHOLD,
-    margin=MODEL_FLOWER_MARGIN,
-    class_names=MODEL_FLOWER_CLASS_NAMES,
-    multi_label=MODEL_FLOWER_MULTI_LABEL,
-    multi_label_iou_threshold=MODEL_FLOWER_MULTI_LABEL_IOU_THRESHOLD,
-    augment=MODEL_FLOWER_AUGMENT,
-    max_det=MODEL_FLOWER_MAX_DETECTIONS,
-)
+        filename = dir_input.get_next(scan=scan)
+        if filename is None:
+            return None
+        return InputImage(filename)
+
+
+def get_capture_time(filename):
+    """
+    Unix time of the capture timestamp in the filename, the current time if there is none
+    """
+    node_id, timestamp = MessageGenerator().get_nodeid_timestamp_from_filename(
+        os.path.basename(filename).split(".")[0]
+    )
+    if timestamp == datetime.datetime.fromtimestamp(0):
+        return time.time()
+    capture_time = timestamp.replace(tzinfo=datetime.timezone.utc).timestamp()
+    return min(capture_time, time.time())
+
+
+def refill_scheduler():
+    """
+    Move new images from the input to the scheduler, at most every
+    SCHEDULER_REFILL_INTERVAL seconds unless the scheduler is empty.
+    All files found in the directory are added, the directory is scanned
+    again once fewer than SCHEDULER_MAX_PENDING images are pending or every
+    SCHEDULER_SCAN_INTERVAL seconds. The other inputs are read ahead by at
+    most SCHEDULER_MAX_PENDING images.
+    """
+    global last_refill_time, last_scan_time
+    if (
+        scheduler.pending() > 0
+        and time.time() - last_refill_time < SCHEDULER_REFILL_INTERVAL
+    ):
+        return
+    last_refill_time = time.time()
+    if dir_input is not None and (
+        scheduler.pending() < SCHEDULER_MAX_PENDING
+        or time.time() - last_scan_time >= SCHEDULER_SCAN_INTERVAL
+    ):
+        dir_input.scan()
+        last_scan_time = time.time()
+    while dir_input is not None or scheduler.pending() < SCHEDULER_MAX_PENDING:
+        item = request_input(scan=False)
+        if item is None:
+            break
+        scheduler.add(
+            item,
+            node_id=get_node_id(item.filename),
+            added=get_capture_time(item.filename),
+        )
+
+
+def get_backlog():
+    """
+    Number of images waiting in the scheduler, in the decode queue and in the input.
+    The backlog of the message queue is not known, only the images fetched in advance count.
+    """
+    backlog = scheduler.pending() + len(decode_queue)
+    if dir_input is not None:
+        backlog += dir_input.pending()
+    elif archive_input is not None:
+        backlog += archive_input.get_remaining()
+    return backlog
+
+
+def get_input():
+    """
+    Returns the next image, the following DECODE_WORKERS images are decoded in the background
+    """
+    refill_scheduler()
+    while len(decode_queue) < DECODE_WORKERS + 1:
+        item = scheduler.get_next()
+        if item is None:
+            break
+        if decode_pool is not None:
+            item.decode_async(decode_pool)
+        decode_queue.append(item)
+    if len(decode_queue) == 0:
+        return None
+    return decode_queue.popleft()
+
+
+def load_models(models_config):
+    """
+    Create and warm up the flower and the pollinator model, and the gating
+    rules and the region planner for the pollinator pass
+    """
+    flower = create_model(models_config.get("flower"))
+    pollinator = create_model(models_config.get("pollinator"))
+    gate = create_flower_gate(models_config.get("pollinator").get("gating"))
+    planner = create_region_planner(
+        models_config.get("pollinator").get("merge_regions")
+    )
+    warmup_passes = models_config.get("warmup_passes", 1)
+    if warmup_passes > 0:
+        t0 = time.time()
+        flower.warmup(warmup_passes)
+        pollinator.warmup(warmup_passes, POLLINATOR_BATCH_SIZE)
+        log.info("Warmed up models in {:.1f} s".format(time.time() - t0))
+    return flower, pollinator, gate, planner
+
+
+def reload_models():
+    with open(args.config, "r") as stream:
+        new_cfg = yaml.safe_load(stream)
+    return load_models(new_cfg.get("models"))
+
+
+def swap_models():
+    """
+    Use the reloaded models, if any. Called between two images.
+    """
+    global flower_model, pollinator_model, flower_gate, region_planner
+    models = reloader.get_pending()
+    if models is None:
+        return
+    flower_model, pollinator_model, flower_gate, region_planner = models
+    log.info(
+        "Switched to flower model {} ({}), pollinator model {} ({})".format(
+            flower_model.model_name,
+            flower_model.model_version,
+            pollinator_model.model_name,
+            pollinator_model.model_version,
+        )
+    )
+
+
+flower_model, pollinator_model, flower_gate, region_planner = None, None, None, None
+if ROLE != "coordinator":
+    flower_model, pollinator_model, flower_gate, region_planner = load_models(
+        models_config
+    )
 
-# Init Pollinator Model
-pollinator_model = YoloModel(
-    MODEL_POLLINATOR_WEIGHTS,
-    image_size=MODEL_POLLINATOR_IMG_SIZE,
-    confidence_threshold=MODEL_POLLINATOR_CONFIDENCE_THRESHOLD,
-    iou_threshold=MODEL_POLLINATOR_IOU_THRESHOLD,
-    margin=MODEL_POLLINATOR_MARGIN,
-    class_names=MODEL_POLLINATOR_CLASS_NAMES,
-    multi_label=MODEL_POLLINATOR_MULTI_LABEL,
-    multi_label_iou_threshold=MODEL_POLLINATOR_MULTI_LABEL_IOU_THRESHOLD,
-    augment=MODEL_POLLINATOR_AUGMENT,
-    max_det=MODEL_POLLINATOR_MAX_DETECTIONS,
+# Hot reload of the models on SIGHUP or when the config file changes
+reload_config = cfg.get("reload") or {}
+reloader = ModelReloader(
+    reload_models,
+    config_path=args.config if reload_config.get("watch_config", False) else None,
+    watch_interval=reload_config.get("watch_interval", 10),
 )
 
-while True:
-    filename = get_filename()
-    if filename is not None:
-        generator = MessageGenerator()
-        log.info("Processing image: %s", os.path.basename(filename))
-        generator.set_filename(os.path.basename(filename))
-
-        flower_model.reset_inference_times()
-        pollinator_model.reset_inference_times()
-        pollinator_index = 0
-        # predict flower
-        try:
-            img = Image.open(filename)
-            original_width, original_height = img.size
-            flower_model.predict(img)
-        except Exception as e:
-            log.error("Error predicting flowers on file %s: %s", filename, e)
-            continue
+
+def process_image(img, generator):
+    """
+    Run the flower and the pollinator model on an image and add the results to the generator
+    """
+    flower_model.reset_inference_times()
+    pollinator_model.reset_inference_times()
+    with profile_region("flower_model.predict"):
+        flower_model.predict(img)
+    with profile_region("get_crops"):
         flower_crops = flower_model.get_crops()
-        flower_boxes = flower_model.get_boxes()
-        flower_classes = flower_model.get_classes()
-        flower_scores = flower_model.get_scores()
-        flower_names = flower_model.get_names()
-        for flower_index in tqdm(range(len(flower_crops))):
-            # add flower to message
-            # TODO: add flower to message
-            width, height = (
-                flower_crops[flower_index].shape[1],
-                flower_crops[flower_index].shape[0],
-            )
-            flower_obj = Flower(
-                index=flower_index,
-                class_name=flower_names[flower_index],
-                score=flower_scores[flower_index],
-                width=width,
-                height=height,
-            )
-            generator.add_flower(flower_obj)
-            # predict pollinator
-            pollinator_model.predict(flower_crops[flower_index])
-            pollinator_boxes = pollinator_model.get_boxes()
-            pollinator_crops = pollinator_model.get_crops()
-            pollinator_classes = pollinator_model.get_classes()
-            pollinator_scores = pollinator_model.get_scores()
-            pollinator_names = pollinator_model.get_names()
-            pollinator_indexes = pollinator_model.get_indexes()
+        flower_crop_boxes = flower_model.get_crop_boxes()
+    flower_scores = flower_model.get_scores()
+    flower_names = flower_model.get_names()
+    crop_sizes = [(crop.shape[1], crop.shape[0]) for crop in flower_crops]
+    skip_reasons = flower_gate.select(flower_names, flower_scores, crop_sizes)
+    for flower_index in range(len(flower_crops)):
+        width, height = crop_sizes[flower_index]
+        flower_obj = Flower(
+            index=flower_index,
+            class_name=flower_names[flower_index],
+            score=flower_scores[flower_index],
+            width=width,
+            height=height,
+            skipped=skip_reasons[flower_index],
+        )
+        generator.add_flower(flower_obj)
+    selected_flowers = [i for i in range(len(flower_crops)) if skip_reasons[i] is None]
+    if flower_gate.is_enabled():
+        skipped = {}
+        for reason in skip_reasons:
+            if reason is not None:
+                skipped[reason] = skipped.get(reason, 0) + 1
+        generator.add_metadata(
+            {"selected": len(selected_flowers), "skipped": skipped}, "flower_gating"
+        )
+    # plan the windows for the pollinator model, overlapping crops can be merged
+    with profile_region("plan_regions"):
+        windows = []
+        for window, members in region_planner.plan(
+            [flower_crop_boxes[i] for i in selected_flowers]
+        ):
+            windows.append((window, [selected_flowers[i] for i in members]))
+    image_array = flower_model.get_image()
+    # pollinators of all windows, boxes in image coordinates
+    detections = []
+    outside_crops = 0
+    # predict pollinators, POLLINATOR_BATCH_SIZE windows at once
+    for batch_start in tqdm(range(0, len(windows), POLLINATOR_BATCH_SIZE)):
+        batch_windows = windows[batch_start : batch_start + POLLINATOR_BATCH_SIZE]
+        batch = [image_array[w[1] : w[3], w[0] : w[2]] for w, _ in batch_windows]
+        with profile_region("pollinator_model.predict"):
+            pollinator_model.predict(batch)
+        for batch_index in range(len(batch)):
+            window_index = batch_start + batch_index
+            window, window_flowers = batch_windows[batch_index]
+            with profile_region("get_crops"):
+                pollinator_crops = pollinator_model.get_crops(batch_index)
+            pollinator_scores = pollinator_model.get_scores(batch_index)
+            pollinator_names = pollinator_model.get_names(batch_index)
+            pollinator_boxes = None
+            if region_planner.enabled:
+                pollinator_boxes = pollinator_model.get_boxes(batch_index)
+            with profile_region("get_indexes"):
+                pollinator_indexes = pollinator_model.get_indexes(batch_index)
             for detected_pollinator in range(len(pollinator_crops)):
-                idx = pollinator_index + pollinator_indexes[detected_pollinator]
-                crop_image = Image.fromarray(pollinator_crops[detected_pollinator])
-                width_polli, height_polli = crop_image.size
-                # add pollinator to message
-                pollinator_obj = Pollinator(
-                    index=idx,
-                    flower_index=flower_index,
-                    class_name=pollinator_names[detected_pollinator],
-                    score=pollinator_scores[detected_pollinator],
-                    width=width_polli,
-                    height=height_polli,
-                    crop=crop_image,
+                box = None
+                flower_indexes = window_flowers
+                if pollinator_boxes is not None:
+                    box = pollinator_boxes[detected_pollinator]
+                    box = [
+                        box[0] + window[0],
+                        box[1] + window[1],
+                        box[2] + window[0],
+                        box[3] + window[1],
+                    ]
+                if len(window_flowers) > 1:
+                    # map the pollinator back to the flowers whose crop contains it
+                    flower_indexes = [
+                        window_flowers[i]
+                        for i in assign_to_regions(
+                            box, [flower_crop_boxes[f] for f in window_flowers]
+                        )
+                    ]
+                    if len(flower_indexes) == 0:
+                        # in the part of the merged window outside of every flower crop
+                        outside_crops += 1
+                        continue
+                detections.append(
+                    {
+                        "group": (
+                            window_index,
+                            pollinator_indexes[detected_pollinator],
+                        ),
+                        "window": window_index,
+                        "box": box,
+                        "class_name": pollinator_names[detected_pollinator],
+                        "score": pollinator_scores[detected_pollinator],
+                        "crop": pollinator_crops[detected_pollinator],
+                        "flower_indexes": list(flower_indexes),
+                    }
                 )
-                generator.add_pollinator(pollinator_obj)
-            if len(pollinator_indexes) > 0:
-                pollinator_index += max(pollinator_indexes) + 1
-        log.info("Found {} flowers in {} ms".format(len(flower_crops), int(flower_model.get_inference_times()[0]*1000)))
-        log.info("Found {} pollinators in {} ms".format(pollinator_index, int(pollinator_model.get_inference_times()[0]*1000)))
-        # add metadata to message
-        generator.add_metadata(flower_model.get_metadata(), "flower_inference")
-        generator.add_metadata(pollinator_model.get_metadata(), "pollinator_inference")
+    # pollinators found in several windows are only reported once
+    duplicates = region_planner.find_duplicates(
+        [d["box"] for d in detections],
+        [d["score"] for d in detections],
+        [d["class_name"] for d in detections],
+        [d["window"] for d in detections],
+    )
+    for duplicate, kept in duplicates.items():
+        for flower_index in detections[duplicate]["flower_indexes"]:
+            if flower_index not in detections[kept]["flower_indexes"]:
+                detections[kept]["flower_indexes"].append(flower_index)
+    if region_planner.enabled:
         generator.add_metadata(
-            {"size": [original_width, original_height]}, "original_image"
+            {
+                "flowers": len(selected_flowers),
+                "windows": len(windows),
+                "outside_crops": outside_crops,
+                "duplicates": len(duplicates),
+            },
+            "region_planning",
         )
-
-        result = generator.generate_message()
-        if IGNORE_EMPTY_RESULTS and len(generator.pollinators) == 0:
-            log.info("No pollinators detected, skipping")
+    # detections of the same object (multi label) share their index
+    group_indexes = {}
+    for i, detection in enumerate(detections):
+        if i in duplicates:
             continue
+        if detection["group"] not in group_indexes:
+            group_indexes[detection["group"]] = len(group_indexes)
+        crop = detection["crop"]
+        flower_indexes = detection["flower_indexes"]
+        # add pollinator to message
+        pollinator_obj = Pollinator(
+            index=group_indexes[detection["group"]],
+            flower_index=flower_indexes[0],
+            class_name=detection["class_name"],
+            score=detection["score"],
+            width=crop.shape[1],
+            height=crop.shape[0],
+            crop=crop,
+            flower_indexes=flower_indexes if len(flower_indexes) > 1 else None,
+        )
+        generator.add_pollinator(pollinator_obj)
+    pollinator_index = len(group_indexes)
+    log.info(
+        "Found {} flowers in {} ms".format(
+            len(flower_crops), int(flower_model.get_inference_times()[0] * 1000)
+        )
+    )
+    log.info(
+        "Found {} pollinators in {} ms".format(
+            pollinator_index, int(pollinator_model.get_inference_times()[0] * 1000)
+        )
+    )
+    # add metadata to message
+    generator.add_metadata(flower_model.get_metadata(), "flower_inference")
+    generator.add_metadata(pollinator_model.get_metadata(), "pollinator_inference")
+
+
+def run_autotune():
+    autotune_config = cfg.get("autotune") or {}
+    sample_dir = autotune_config.get("sample_dir")
+    extension = autotune_config.get("extension", ".jpg")
+    if sample_dir is None and dir_input is not None:
+        sample_dir = dir_input.path
+        extension = dir_input.format
+    if sample_dir is None:
+        log.error("autotune.sample_dir is not configured")
+        exit(1)
+    sample_input = DirectoryInput(sample_dir, extension)
+    sample_input.scan()
+    # the encoded images are kept in memory, decoding is part of the measurement
+    images = []
+    for filename in sample_input.files[: autotune_config.get("number_of_images", 10)]:
+        with open(filename, "rb") as f:
+            images.append(InputImage(filename, data=f.read(), position=len(images)))
+    candidates = {
+        "torch_threads": autotune_config.get(
+            "torch_threads", get_default_thread_candidates()
+        ),
+        "pollinator_batch_size": autotune_config.get(
+            "pollinator_batch_size", [1, 2, 4, 8]
+        ),
+        "decode_workers": autotune_config.get("decode_workers", [0, 1, 2]),
+        "crop_encoding_workers": autotune_config.get(
+            "crop_encoding_workers", [0, 2, 4]
+        ),
+    }
+
+    def apply_fn(settings):
+        apply_performance_settings(settings)
+        set_decode_workers(settings.get("decode_workers"))
+        crop_encoder.set_workers(settings.get("crop_encoding_workers"))
+
+    def process_fn(item):
+        # decode the following images in the background, as get_input does
+        if decode_pool is not None:
+            for next_item in images[item.position + 1 :][:DECODE_WORKERS]:
+                if next_item.future is None:
+                    next_item.decode_async(decode_pool)
+        img = item.get_image()
+        item.future = None
+        generator = MessageGenerator()
+        process_image(img, generator)
+        crop_encoder.encode_pollinators(generator.pollinators)
+
+    try:
+        tuner = Autotuner(
+            process_fn,
+            apply_fn,
+            images,
+            candidates,
+            warmup=autotune_config.get("warmup", 1),
+            search=autotune_config.get("search", "coordinate"),
+            max_rounds=autotune_config.get("max_rounds", 2),
+            start=performance_settings,
+        )
+        best = tuner.run()
+    except ValueError as e:
+        log.error(e)
+        exit(1)
+    log.info(
+        "Best settings: {} ({} images/s)".format(
+            best["settings"], best["images_per_second"]
+        )
+    )
+    save_profile(PROFILE_PATH, tuner.generate_profile(best, HOSTNAME))
+
+
+if args.autotune:
+    run_autotune()
+    exit(0)
+
+
+def get_scheduling_metadata(item):
+    return {
+        "policy": scheduler.policy,
+        "wait_time": round(scheduler.get_wait_time(item), 3),
+        "node_backlog": scheduler.pending(get_node_id(item.filename)),
+    }
+
+
+def handle_input(item):
+    """
+    Run the pipeline on an image, returns the message generator with the
+    generated message, or None if the image was skipped or could not be processed
+    """
+    filename = item.filename
+    generator = MessageGenerator()
+    log.info("Processing image: %s", os.path.basename(filename))
+    generator.set_filename(os.path.basename(filename))
+    shedding_settings = {}
+    if load_shedder is not None:
+        # images of the archives are not dropped, they would never be processed
+        if archive_input is None and load_shedder.should_skip(get_node_id(filename)):
+            log.info("Load shedding: skipping %s", os.path.basename(filename))
+            return None
+        shedding_settings = load_shedder.get_settings()
+        pollinator_model.apply_overrides(shedding_settings)
+        generator.add_metadata(load_shedder.get_metadata(), "load_shedding")
+    encode_crops = ENCODE_CROPS and not shedding_settings.get("skip_crops", False)
+
+    # predict flowers and pollinators
+    try:
+        with profile_region("decode"):
+            img = item.get_image()
+        original_width, original_height = img.size
+        process_image(img, generator)
+    except Exception as e:
+        log.error("Error predicting flowers on file %s: %s", filename, e)
+        return None
+    generator.add_metadata(
+        {"size": [original_width, original_height]}, "original_image"
+    )
+    if ROLE == "worker":
+        # the coordinator adds the scheduling metadata
+        generator.add_metadata({"hostname": HOSTNAME}, "worker")
+    else:
+        generator.add_metadata(get_scheduling_metadata(item), "scheduling")
+    if IGNORE_EMPTY_RESULTS and len(generator.pollinators) == 0:
+        log.info("No pollinators detected, skipping")
+        return None
+    if encode_crops:
+        with profile_region("crop_encoding"):
+            encode_time = crop_encoder.encode_pollinators(generator.pollinators)
+        crop_metadata = crop_encoder.get_metadata()
+        crop_metadata["encode_time"] = round(encode_time, 3)
+        generator.add_metadata(crop_metadata, "crop_encoding")
+    generator.set_message(generator.generate_message(save_crop=encode_crops))
+    return generator
+
+
+def publish(item, generator):
+    """
+    Store and transmit the message of the generator
+    """
+    result = generator.generate_message()
+    with profile_region("outputs"):
         if STORE_FILE:
             generator.store_message(BASE_DIR, SAVE_CROPS)
+        transmitted = result
+        if delta_encoder is not None and (TRANSMIT_HTTP or TRANSMIT_MQTT):
+            transmitted = delta_encoder.encode(generator.node_id, result)
         if TRANSMIT_HTTP:
-            hclient.send_message(
-                result,
+            sent = hclient.send_message(
+                transmitted,
                 filename=generator.generate_filename(),
                 node_id=generator.node_id,
                 hostname=HOSTNAME,
             )
+            if not sent and delta_encoder is not None:
+                # the receiver cannot apply the next delta, send a keyframe
+                delta_encoder.reset(generator.node_id)
         if TRANSMIT_MQTT:
             mclient.publish(
-                result,
+                transmitted,
                 filename=generator.generate_filename(),
                 node_id=generator.node_id,
                 hostname=HOSTNAME,
             )
 
-        # print(json.dumps(result))
-        if REMOVE_FILES_AFTER_PROCESSING:
-            log.info("Removing file %s", filename)
-            os.remove(filename)
+    # print(json.dumps(result))
+    if REMOVE_FILES_AFTER_PROCESSING and item.is_file():
+        log.info("Removing file %s", item.filename)
+        os.remove(item.filename)
 
-    else:
+
+def complete(item):
+    scheduler.complete(item)
+    if archive_input is not None:
+        archive_input.mark_done(item)
+
+
+def process_next():
+    """
+    Process the next image, returns False if no data is available
+    """
+    swap_models()
+    item = get_input()
+    if item is None:
+        return False
+    t0 = time.time()
+    generator = None
+    try:
+        generator = handle_input(item)
+        if generator is not None and ROLE != "worker":
+            publish(item, generator)
+    finally:
+        if load_shedder is not None:
+            load_shedder.update(get_backlog(), scheduler.get_latency(item))
+        if coordinator_client is not None:
+            coordinator_client.report(
+                item,
+                generator.generate_message() if generator is not None else None,
+                time.time() - t0,
+            )
+        complete(item)
+    return True
+
+
+def publish_worker_result(item, message):
+    if message is None:
+        return
+    if IGNORE_EMPTY_RESULTS and len(message["detections"]["pollinators"]) == 0:
+        log.info("No pollinators detected, skipping")
+        return
+    message["metadata"]["scheduling"] = get_scheduling_metadata(item)
+    generator = MessageGenerator()
+    generator.set_filename(os.path.basename(item.filename))
+    generator.set_message(message)
+    publish(item, generator)
+
+
+def run_coordinator():
+    coordinator = Coordinator(
+        DISTRIBUTED_PORT,
+        get_input,
+        publish_worker_result,
+        complete,
+        batch_size=DISTRIBUTED_BATCH_SIZE,
+        lease_timeout=distributed_config.get("lease_timeout", 300),
+        send_images=distributed_config.get("send_images", False),
+        stats_interval=distributed_config.get("stats_interval", 60),
+    )
+    while True:
+        coordinator.poll(1000)
+
+
+def run_profile(number_of_images):
+    profiler = PipelineProfiler(args.profile_dir)
+    profiler.start()
+    processed = 0
+    try:
+        while processed < number_of_images:
+            if not process_next():
+                log.warning(
+                    "No data available, stopping after {} images".format(processed)
+                )
+                break
+            processed += 1
+    finally:
+        profiler.stop()
+
+
+if args.profile is not None:
+    run_profile(args.profile)
+    exit(0)
+
+if ROLE == "coordinator":
+    run_coordinator()
+
+reloader.start()
+while True:
+    if not process_next():
         log.info("No data available")
         time.sleep(5)
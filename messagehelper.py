@@ -10,6 +10,7 @@ import sys
 import logging
 import ssl
 import requests
+from profiling import profile_region
 
 log = logging.getLogger(__name__)
 log.propagate = False
@@ -30,14 +31,18 @@ class Flower:
     score: float
     width: int
     height: int
+    skipped: str = None  # reason why the pollinator pass was skipped
 
     def to_dict(self):
-        return {
+        flower_dict = {
             "index": self.index,
             "class_name": self.class_name,
             "score": round(float(self.score), DECIMALS_TO_ROUND),
             "size": [self.width, self.height],
         }
+        if self.skipped is not None:
+            flower_dict["skipped"] = self.skipped
+        return flower_dict
 
 
 @dataclass
@@ -48,7 +53,10 @@ class Pollinator:
     score: float
     width: int
     height: int
-    crop: Image
+    crop: object  # numpy array (RGB) or PIL Image
+    encoded_crop: str = None  # base64 encoded JPEG, see CropEncoder
+    # all flowers containing the pollinator, if more than one
+    flower_indexes: list = None
 
     def to_dict(self, save_crop=True):
 
@@ -59,9 +67,16 @@ class Pollinator:
             "score": round(self.score, DECIMALS_TO_ROUND),
             "crop": None,
         }
-        if save_crop:
+        if self.flower_indexes is not None:
+            pollintor_dict["flower_indexes"] = self.flower_indexes
+        if save_crop and self.encoded_crop is not None:
+            pollintor_dict["crop"] = self.encoded_crop
+        elif save_crop:
+            crop = self.crop
+            if not isinstance(crop, Image.Image):
+                crop = Image.fromarray(crop)
             bio = BytesIO()
-            self.crop.save(bio, format="JPEG")
+            crop.save(bio, format="JPEG")
             bio.seek(0)
             encoded_image = base64.b64encode(bio.read()).decode("utf-8")
             pollintor_dict["crop"] = encoded_image
@@ -76,6 +91,7 @@ class MessageGenerator:
         self.pollinators = []
         self.metadata = {}
         self.filename = None
+        self.message = None
 
     def set_filename(self, filename):
         self.filename = filename.split("/")[-1].split(".")[0]
@@ -103,13 +119,30 @@ class MessageGenerator:
     def add_pollinator(self, pollinator: Pollinator):
         self.pollinators.append(pollinator)
 
+    def set_message(self, message: dict):
+        """
+        Use a message which was already generated, e.g. by a worker
+        """
+        self.message = message
+
     def generate_message(self, save_crop=True):
+        if self.message is not None:
+            if save_crop:
+                return self.message
+            pollinators = [
+                dict(p, crop=None) for p in self.message["detections"]["pollinators"]
+            ]
+            return {
+                "detections": dict(self.message["detections"], pollinators=pollinators),
+                "metadata": self.message["metadata"],
+            }
         flowers = []
         pollinators = []
         for flower in self.flowers:
             flowers.append(flower.to_dict())
-        for pollinator in self.pollinators:
-            pollinators.append(pollinator.to_dict())
+        with profile_region("Pollinator.to_dict"):
+            for pollinator in self.pollinators:
+                pollinators.append(pollinator.to_dict(save_crop=save_crop))
         flowers.sort(key=lambda x: x["index"])
         pollinators.sort(key=lambda x: x["index"])
 
@@ -0,0 +1,145 @@
+import contextlib
+import cProfile
+import os
+import sys
+import threading
+import time
+import logging
+
+log = logging.getLogger(__name__)
+log.propagate = False
+log.setLevel(logging.INFO)
+handler = logging.StreamHandler(stream=sys.stdout)
+handler.setFormatter(
+    logging.Formatter("%(asctime)s %(name)s %(levelname)s %(message)s")
+)
+log.addHandler(handler)
+
+_active_profiler = None
+_no_region = contextlib.nullcontext()
+
+
+def profile_region(name):
+    """
+    Attribute the enclosed code to a named pipeline region.
+    Does nothing unless a PipelineProfiler is running.
+    """
+    if _active_profiler is None:
+        return _no_region
+    return _active_profiler.region(name)
+
+
+class PipelineProfiler:
+    """
+    Profile the pipeline with cProfile, the torch profiler and a stack sampler.
+
+    Output files in output_dir:
+        pipeline.prof: cProfile stats (e.g. for snakeviz)
+        pipeline.collapsed: sampled stacks, prefixed with the region names (for flamegraph.pl / speedscope)
+        trace.json: torch profiler trace (for chrome://tracing / perfetto)
+        operators.txt: torch operators sorted by total cpu time
+    """
+
+    def __init__(self, output_dir="profile", sample_interval=0.005):
+        self.output_dir = output_dir
+        self.sample_interval = sample_interval
+        self.regions = []
+        self.region_times = {}
+        self.region_counts = {}
+        self.stacks = {}
+        self.thread_id = None
+        self.cprofile = None
+        self.torch_profiler = None
+        self.sampler = None
+        self.running = False
+
+    @contextlib.contextmanager
+    def region(self, name):
+        import torch
+
+        self.regions.append(name)
+        t0 = time.time()
+        try:
+            with torch.profiler.record_function(name):
+                yield
+        finally:
+            self.region_times[name] = self.region_times.get(name, 0) + time.time() - t0
+            self.region_counts[name] = self.region_counts.get(name, 0) + 1
+            self.regions.pop()
+
+    def _sample(self):
+        while self.running:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        "{} ({}:{})".format(
+                            code.co_name,
+                            os.path.basename(code.co_filename),
+                            code.co_firstlineno,
+                        )
+                    )
+                    frame = frame.f_back
+                stack.reverse()
+                stack = ["[{}]".format(r) for r in list(self.regions)] + stack
+                key = ";".join(stack)
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+            time.sleep(self.sample_interval)
+
+    def start(self):
+        global _active_profiler
+        import torch
+
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self.torch_profiler = torch.profiler.profile(activities=activities)
+        self.torch_profiler.__enter__()
+        self.thread_id = threading.get_ident()
+        self.running = True
+        self.sampler = threading.Thread(target=self._sample, daemon=True)
+        self.sampler.start()
+        self.cprofile = cProfile.Profile()
+        self.cprofile.enable()
+        _active_profiler = self
+        log.info("Profiling started")
+
+    def stop(self):
+        global _active_profiler
+        _active_profiler = None
+        self.cprofile.disable()
+        self.running = False
+        self.sampler.join()
+        self.torch_profiler.__exit__(None, None, None)
+        self.write()
+
+    def write(self):
+        if not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir)
+        self.cprofile.dump_stats(os.path.join(self.output_dir, "pipeline.prof"))
+        with open(os.path.join(self.output_dir, "pipeline.collapsed"), "w") as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write("{} {}\n".format(stack, count))
+        self.torch_profiler.export_chrome_trace(
+            os.path.join(self.output_dir, "trace.json")
+        )
+        with open(os.path.join(self.output_dir, "operators.txt"), "w") as f:
+            f.write(
+                self.torch_profiler.key_averages().table(
+                    sort_by="cpu_time_total", row_limit=50
+                )
+            )
+        log.info("Wrote profiling results to {}".format(self.output_dir))
+        for name, total in sorted(
+            self.region_times.items(), key=lambda x: x[1], reverse=True
+        ):
+            log.info(
+                "{}: {} ms total, {} calls, {} ms per call".format(
+                    name,
+                    int(total * 1000),
+                    self.region_counts[name],
+                    round(total * 1000 / self.region_counts[name], 1),
+                )
+            )
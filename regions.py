@@ -0,0 +1,148 @@
+"""
+Plan the windows for the pollinator inference: overlapping flower crops are
+merged, so that the pollinator model sees every pixel only once.
+
+box format: [xmin, ymin, xmax, ymax]
+"""
+
+
+def _area(box):
+    return max(0, box[2] - box[0]) * max(0, box[3] - box[1])
+
+
+def _intersection(bb1, bb2):
+    x_left = max(bb1[0], bb2[0])
+    y_top = max(bb1[1], bb2[1])
+    x_right = min(bb1[2], bb2[2])
+    y_bottom = min(bb1[3], bb2[3])
+    if x_right <= x_left or y_bottom <= y_top:
+        return 0
+    return (x_right - x_left) * (y_bottom - y_top)
+
+
+def _iou(bb1, bb2):
+    intersection = _intersection(bb1, bb2)
+    if intersection == 0:
+        return 0
+    return intersection / (_area(bb1) + _area(bb2) - intersection)
+
+
+def _union(bb1, bb2):
+    return [
+        min(bb1[0], bb2[0]),
+        min(bb1[1], bb2[1]),
+        max(bb1[2], bb2[2]),
+        max(bb1[3], bb2[3]),
+    ]
+
+
+def merge_regions(boxes, min_overlap=0.0, max_size=None):
+    """
+    Merge overlapping boxes into windows.
+
+    Two windows are merged if their intersection is larger than min_overlap
+    times the area of the smaller window, and if the merged window is not
+    wider or higher than max_size.
+    Returns a list of (window, indexes of the boxes in the window)
+    """
+    windows = [(list(box), [i]) for i, box in enumerate(boxes)]
+    merged = True
+    while merged:
+        merged = False
+        for a in range(len(windows)):
+            for b in range(a + 1, len(windows)):
+                box_a, box_b = windows[a][0], windows[b][0]
+                intersection = _intersection(box_a, box_b)
+                if intersection == 0:
+                    continue
+                if intersection <= min_overlap * min(_area(box_a), _area(box_b)):
+                    continue
+                union = _union(box_a, box_b)
+                if max_size is not None and (
+                    union[2] - union[0] > max_size or union[3] - union[1] > max_size
+                ):
+                    continue
+                windows[a] = (union, sorted(windows[a][1] + windows[b][1]))
+                del windows[b]
+                merged = True
+                break
+            if merged:
+                break
+    return windows
+
+
+def assign_to_regions(box, regions):
+    """
+    Returns the indexes of the regions which contain the center of the box,
+    the smallest region first. The list is empty if no region contains the center.
+    """
+    x = (box[0] + box[2]) / 2
+    y = (box[1] + box[3]) / 2
+    containing = [
+        i
+        for i, region in enumerate(regions)
+        if region[0] <= x <= region[2] and region[1] <= y <= region[3]
+    ]
+    return sorted(containing, key=lambda i: _area(regions[i]))
+
+
+def find_duplicates(boxes, scores, class_names, windows, iou_threshold=0.5):
+    """
+    Detections of the same class from different windows whose boxes (in image
+    coordinates) have an IoU above iou_threshold are the same object.
+    Returns a dict: index of a duplicate -> index of the detection which is
+    kept (the one with the highest score)
+    """
+    duplicates = {}
+    kept = []
+    for i in sorted(range(len(boxes)), key=lambda i: scores[i], reverse=True):
+        for k in kept:
+            if (
+                windows[k] != windows[i]
+                and class_names[k] == class_names[i]
+                and _iou(boxes[k], boxes[i]) > iou_threshold
+            ):
+                duplicates[i] = k
+                break
+        else:
+            kept.append(i)
+    return duplicates
+
+
+class RegionPlanner:
+    """
+    Plan the pollinator inference windows for a list of flower crop boxes.
+    If merging is disabled, every crop is a window.
+    Pollinators found in several windows (crops which overlap, but were not
+    merged) are reported once, see find_duplicates.
+    """
+
+    def __init__(self, enabled=False, min_overlap=0.0, max_size=None, dedupe_iou=0.5):
+        self.enabled = enabled
+        self.min_overlap = min_overlap
+        self.max_size = max_size
+        self.dedupe_iou = dedupe_iou
+
+    def plan(self, boxes):
+        """
+        Returns a list of (window, indexes of the boxes in the window)
+        """
+        if not self.enabled:
+            return [(list(box), [i]) for i, box in enumerate(boxes)]
+        return merge_regions(boxes, self.min_overlap, self.max_size)
+
+    def find_duplicates(self, boxes, scores, class_names, windows):
+        if not self.enabled:
+            return {}
+        return find_duplicates(boxes, scores, class_names, windows, self.dedupe_iou)
+
+
+def create_region_planner(merge_config):
+    if merge_config is None:
+        merge_config = {}
+    return RegionPlanner(
+        enabled=merge_config.get("enabled", False),
+        min_overlap=merge_config.get("min_overlap", 0.0),
+        max_size=merge_config.get("max_size"),
+        dedupe_iou=merge_config.get("dedupe_iou", 0.5),
+    )
@@ -0,0 +1,92 @@
+import os
+import signal
+import sys
+import threading
+import time
+import logging
+
+log = logging.getLogger(__name__)
+log.propagate = False
+log.setLevel(logging.INFO)
+handler = logging.StreamHandler(stream=sys.stdout)
+handler.setFormatter(
+    logging.Formatter("%(asctime)s %(name)s %(levelname)s %(message)s")
+)
+log.addHandler(handler)
+
+
+class ModelReloader:
+    """
+    Build new models in the background on SIGHUP or when the config file changes.
+
+    load_fn() builds (and warms up) the new models, the main loop picks them
+    up with get_pending() between two images.
+    """
+
+    def __init__(self, load_fn, config_path=None, watch_interval=10):
+        self.load_fn = load_fn
+        self.config_path = config_path
+        self.watch_interval = watch_interval
+        self.lock = threading.Lock()
+        self.pending = None
+        self.loading = False
+        self.config_mtime = None
+        if self.config_path is not None:
+            self.config_mtime = os.path.getmtime(self.config_path)
+
+    def start(self):
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, self._handle_signal)
+            log.info("Send SIGHUP to pid {} to reload the models".format(os.getpid()))
+        if self.config_path is not None and self.watch_interval:
+            threading.Thread(target=self._watch, daemon=True).start()
+            log.info("Watching {} for changes".format(self.config_path))
+
+    def _handle_signal(self, signum, frame):
+        # do not take the lock in the signal handler, the main thread might hold it
+        threading.Thread(target=self.request_reload, daemon=True).start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.watch_interval)
+            try:
+                mtime = os.path.getmtime(self.config_path)
+            except OSError:
+                continue
+            if mtime != self.config_mtime:
+                self.config_mtime = mtime
+                log.info("{} has changed".format(self.config_path))
+                self.request_reload()
+
+    def request_reload(self):
+        with self.lock:
+            if self.loading:
+                log.info("Reload already in progress")
+                return
+            self.loading = True
+        threading.Thread(target=self._load, daemon=True).start()
+
+    def _load(self):
+        log.info("Loading new models")
+        t0 = time.time()
+        try:
+            models = self.load_fn()
+        except Exception as e:
+            log.error(
+                "Reloading models failed, keeping the current models: {}".format(e)
+            )
+            models = None
+        with self.lock:
+            if models is not None:
+                self.pending = models
+                log.info("New models ready after {:.1f} s".format(time.time() - t0))
+            self.loading = False
+
+    def get_pending(self):
+        """
+        Returns the new models once, or None
+        """
+        with self.lock:
+            models = self.pending
+            self.pending = None
+        return models
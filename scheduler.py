@@ -0,0 +1,223 @@
+import os
+import sys
+import time
+import logging
+from collections import deque
+
+log = logging.getLogger(__name__)
+log.propagate = False
+log.setLevel(logging.INFO)
+handler = logging.StreamHandler(stream=sys.stdout)
+handler.setFormatter(
+    logging.Formatter("%(asctime)s %(name)s %(levelname)s %(message)s")
+)
+log.addHandler(handler)
+
+POLICIES = ["fifo", "round_robin", "deadline"]
+
+
+def get_node_id(filename):
+    """
+    Filenames are expected as <node_id>_<timestamp>.<extension>
+    """
+    return os.path.basename(filename).split("_")[0]
+
+
+class NodeStats:
+    def __init__(self):
+        self.processed = 0
+        self.total_latency = 0
+        self.max_latency = 0
+
+    def add(self, latency):
+        self.processed += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def reset(self):
+        self.processed = 0
+        self.total_latency = 0
+        self.max_latency = 0
+
+
+class NodeScheduler:
+    """
+    Group pending images by node_id and decide which node is served next.
+
+    policies:
+        fifo: in the order the images were added
+        round_robin: weighted round robin across the nodes with pending images
+        deadline: earliest deadline first, deadline = capture time + latency target of the node
+
+    added is the capture time of the image (if known). The time-to-result is
+    measured from the capture time if the image was queued within the latency
+    target of its node, otherwise (backfill, e.g. archives or old files) from
+    the time it was queued. Latency targets are only checked for the former.
+    """
+
+    def __init__(
+        self,
+        policy="fifo",
+        weights=None,
+        latency_targets=None,
+        default_weight=1,
+        default_latency_target=600,
+        stats_interval=60,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(
+                "Unknown scheduling policy {}, use one of {}".format(policy, POLICIES)
+            )
+        self.policy = policy
+        self.weights = weights or {}
+        self.latency_targets = latency_targets or {}
+        self.default_weight = default_weight
+        self.default_latency_target = default_latency_target
+        self.stats_interval = stats_interval
+        # node_id -> deque of (sequence, time added, time queued, item)
+        self.queues = {}
+        self.current_weights = {}
+        self.in_progress = {}  # item -> (node_id, time added, time queued)
+        self.stats = {}
+        self.sequence = 0
+        self.last_stats_time = time.time()
+
+    def get_weight(self, node_id):
+        return self.weights.get(node_id, self.default_weight)
+
+    def get_latency_target(self, node_id):
+        return self.latency_targets.get(node_id, self.default_latency_target)
+
+    def add(self, item, node_id=None, added=None):
+        if node_id is None:
+            node_id = get_node_id(item)
+        queued = time.time()
+        if added is None:
+            added = queued
+        if node_id not in self.queues:
+            self.queues[node_id] = deque()
+            self.current_weights[node_id] = 0
+            self.stats[node_id] = NodeStats()
+        self.queues[node_id].append((self.sequence, added, queued, item))
+        self.sequence += 1
+
+    def pending(self, node_id=None):
+        if node_id is not None:
+            return len(self.queues.get(node_id, []))
+        return sum(len(q) for q in self.queues.values())
+
+    def _select_fifo(self, nodes):
+        return min(nodes, key=lambda n: self.queues[n][0][0])
+
+    def _select_deadline(self, nodes):
+        return min(
+            nodes,
+            key=lambda n: self.queues[n][0][1] + self.get_latency_target(n),
+        )
+
+    def _select_round_robin(self, nodes):
+        # smooth weighted round robin
+        total_weight = 0
+        for n in nodes:
+            self.current_weights[n] += self.get_weight(n)
+            total_weight += self.get_weight(n)
+        selected = max(nodes, key=lambda n: self.current_weights[n])
+        self.current_weights[selected] -= total_weight
+        return selected
+
+    def get_next(self):
+        """
+        Returns the next item or None if nothing is pending
+        """
+        nodes = [n for n in self.queues if len(self.queues[n]) > 0]
+        if len(nodes) == 0:
+            return None
+        if self.policy == "round_robin":
+            node_id = self._select_round_robin(nodes)
+        elif self.policy == "deadline":
+            node_id = self._select_deadline(nodes)
+        else:
+            node_id = self._select_fifo(nodes)
+        _, added, queued, item = self.queues[node_id].popleft()
+        self.in_progress[item] = (node_id, added, queued)
+        return item
+
+    def is_live(self, item):
+        """
+        True if the image was queued within the latency target of its capture time
+        """
+        node_id, added, queued = self.in_progress[item]
+        return queued - added <= self.get_latency_target(node_id)
+
+    def get_wait_time(self, item):
+        """
+        Seconds since the image was queued
+        """
+        if item not in self.in_progress:
+            return None
+        return time.time() - self.in_progress[item][2]
+
+    def get_latency(self, item):
+        """
+        Seconds since the capture time of live images, since they were queued otherwise
+        """
+        if item not in self.in_progress:
+            return None
+        if self.is_live(item):
+            return time.time() - self.in_progress[item][1]
+        return self.get_wait_time(item)
+
+    def complete(self, item):
+        """
+        Mark an item as done and record its time-to-result
+        """
+        if item not in self.in_progress:
+            return
+        node_id = self.in_progress[item][0]
+        latency = self.get_latency(item)
+        live = self.is_live(item)
+        del self.in_progress[item]
+        self.stats[node_id].add(latency)
+        if live and latency > self.get_latency_target(node_id):
+            log.warning(
+                "Node {} missed its latency target: {:.1f} s > {} s".format(
+                    node_id, latency, self.get_latency_target(node_id)
+                )
+            )
+        if time.time() - self.last_stats_time >= self.stats_interval:
+            self.log_stats()
+
+    def get_stats(self):
+        stats = {}
+        for node_id, node_stats in self.stats.items():
+            stats[node_id] = {
+                "backlog": self.pending(node_id),
+                "processed": node_stats.processed,
+                "latency_mean": (
+                    round(node_stats.total_latency / node_stats.processed, 3)
+                    if node_stats.processed > 0
+                    else None
+                ),
+                "latency_max": round(node_stats.max_latency, 3),
+                "latency_target": self.get_latency_target(node_id),
+            }
+        return stats
+
+    def log_stats(self):
+        """
+        Log backlog and latency per node since the last call
+        """
+        for node_id, stats in self.get_stats().items():
+            log.info(
+                "node {}: backlog {}, processed {}, latency mean {} s, max {} s, target {} s".format(
+                    node_id,
+                    stats["backlog"],
+                    stats["processed"],
+                    stats["latency_mean"],
+                    stats["latency_max"],
+                    stats["latency_target"],
+                )
+            )
+        for node_stats in self.stats.values():
+            node_stats.reset()
+        self.last_stats_time = time.time()
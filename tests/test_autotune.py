@@ -0,0 +1,83 @@
+import pytest
+
+from autotune import Autotuner, get_default_thread_candidates
+
+CANDIDATES = {
+    "torch_threads": [1, 2, 4],
+    "pollinator_batch_size": [1, 2, 4, 8],
+    "decode_workers": [0, 1, 2],
+    "crop_encoding_workers": [0, 2, 4],
+}
+OPTIMUM = {
+    "torch_threads": 4,
+    "pollinator_batch_size": 2,
+    "decode_workers": 1,
+    "crop_encoding_workers": 2,
+}
+
+
+class FakeTuner(Autotuner):
+    """
+    Throughput falls off with the distance to OPTIMUM instead of running the pipeline
+    """
+
+    def _measure(self, settings):
+        distance = sum(
+            abs(CANDIDATES[n].index(v) - CANDIDATES[n].index(OPTIMUM[n]))
+            for n, v in settings.items()
+        )
+        return {
+            "settings": settings,
+            "images_per_second": 10 - distance,
+            "latency_mean": 0.1,
+            "latency_p50": 0.1,
+            "latency_max": 0.1,
+        }
+
+
+def create_tuner(**kwargs):
+    return FakeTuner(
+        lambda image: None, lambda settings: None, [0], CANDIDATES, **kwargs
+    )
+
+
+def test_default_thread_candidates():
+    candidates = get_default_thread_candidates()
+    assert candidates[0] == 1 and candidates == sorted(set(candidates))
+
+
+def test_coordinate_search():
+    tuner = create_tuner()
+    assert tuner.count_combinations() == 10
+    best = tuner.run()
+    assert best["settings"] == OPTIMUM
+    # two rounds at most, every combination is measured once
+    assert len(tuner.results) <= 20
+    settings = [tuple(r["settings"].values()) for r in tuner.results]
+    assert len(settings) == len(set(settings))
+
+
+def test_coordinate_search_start():
+    # values which are not candidates are replaced with the first candidate
+    tuner = create_tuner(start=dict(OPTIMUM, torch_threads=3), max_rounds=1)
+    assert tuner.run()["settings"] == OPTIMUM
+    assert tuner.results[0]["settings"] == dict(OPTIMUM, torch_threads=1)
+    assert len(tuner.results) == 10
+
+
+def test_grid_search():
+    tuner = create_tuner(search="grid")
+    assert tuner.count_combinations() == 108
+    assert tuner.run()["settings"] == OPTIMUM
+    assert len(tuner.results) == 108
+
+
+def test_invalid_search():
+    with pytest.raises(ValueError):
+        create_tuner(search="random")
+
+
+def test_no_images():
+    tuner = FakeTuner(lambda image: None, lambda settings: None, [], CANDIDATES)
+    with pytest.raises(ValueError):
+        tuner.run()
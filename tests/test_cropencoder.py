@@ -0,0 +1,120 @@
+import base64
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import cropencoder
+from cropencoder import CropEncoder, get_available_encoder
+
+
+class Pollinator:
+    def __init__(self, crop):
+        self.crop = crop
+        self.encoded_crop = None
+
+
+def decode(encoded):
+    return Image.open(BytesIO(base64.b64decode(encoded)))
+
+
+def create_crop(width, height):
+    crop = np.zeros((height, width, 3), dtype=np.uint8)
+    crop[:, : width // 2] = (255, 0, 0)
+    return crop
+
+
+class BrokenTurboJPEG:
+    """
+    The python package is installed, but not libturbojpeg
+    """
+
+    def __init__(self):
+        raise RuntimeError("Unable to locate turbojpeg library automatically")
+
+
+def test_encoder_fallback(monkeypatch):
+    monkeypatch.setattr(cropencoder, "TurboJPEG", BrokenTurboJPEG)
+    monkeypatch.setattr(cropencoder, "cv2", None)
+    assert get_available_encoder() == "pillow"
+    monkeypatch.setattr(cropencoder, "TurboJPEG", None)
+    assert get_available_encoder() == "pillow"
+    assert CropEncoder().encoder == "pillow"
+
+
+def test_unknown_encoder():
+    with pytest.raises(ValueError):
+        CropEncoder(encoder="png")
+
+
+@pytest.mark.parametrize(
+    "size, expected",
+    [
+        ((400, 200), (128, 64)),
+        ((200, 400), (64, 128)),
+        ((100, 50), (100, 50)),
+        ((1000, 2), (128, 1)),
+    ],
+)
+def test_resize(monkeypatch, size, expected):
+    # the pillow fallback of the resize
+    monkeypatch.setattr(cropencoder, "cv2", None)
+    encoder = CropEncoder(max_dimension=128, encoder="pillow")
+    resized = encoder._resize(create_crop(*size))
+    assert (resized.shape[1], resized.shape[0]) == expected
+    assert decode(encoder.encode(create_crop(*size))).size == expected
+
+
+def test_no_max_dimension():
+    encoder = CropEncoder(encoder="pillow")
+    crop = create_crop(900, 700)
+    assert encoder._resize(crop) is crop
+
+
+def test_encode_pillow():
+    encoder = CropEncoder(quality=90, encoder="pillow")
+    image = decode(encoder.encode(create_crop(64, 32)))
+    assert image.format == "JPEG" and image.size == (64, 32)
+    # RGB order is kept: the left half is red
+    r, g, b = image.convert("RGB").getpixel((8, 16))
+    assert r > 200 and g < 50 and b < 50
+    # PIL images are accepted as well
+    assert decode(encoder.encode(Image.new("L", (20, 10)))).size == (20, 10)
+
+
+@pytest.mark.parametrize("encoder", ["opencv", "turbojpeg"])
+def test_encode_optional_encoders(encoder):
+    if encoder == "opencv":
+        pytest.importorskip("cv2")
+    else:
+        pytest.importorskip("turbojpeg")
+        if get_available_encoder() != "turbojpeg":
+            pytest.skip("libturbojpeg is not installed")
+    image = decode(CropEncoder(encoder=encoder).encode(create_crop(64, 32)))
+    r, g, b = image.convert("RGB").getpixel((8, 16))
+    assert r > 200 and g < 50 and b < 50
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_encode_pollinators(workers):
+    encoder = CropEncoder(workers=workers, encoder="pillow")
+    pollinators = [Pollinator(create_crop(16 + i, 16)) for i in range(5)]
+    assert encoder.encode_pollinators(pollinators) >= 0
+    assert [decode(p.encoded_crop).size for p in pollinators] == [
+        (16 + i, 16) for i in range(5)
+    ]
+
+
+def test_set_workers():
+    encoder = CropEncoder(workers=2, encoder="pillow")
+    pool = encoder.pool
+    encoder.set_workers(0)
+    assert encoder.pool is None and encoder.workers == 0
+    # the previous pool was shut down
+    with pytest.raises(RuntimeError):
+        pool.submit(print)
+    encoder.set_workers(None)
+    assert encoder.pool is None and encoder.workers == 0
+    encoder.set_workers(4)
+    assert encoder.pool is not None and encoder.workers == 4
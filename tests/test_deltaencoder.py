@@ -0,0 +1,164 @@
+import copy
+import json
+import random
+
+from deltaencoder import (
+    DeltaEncoder,
+    DeltaReconstructor,
+    diff_detections,
+    apply_detections,
+)
+
+CROP = "A" * 2000  # base64 encoded crop
+
+
+def make_message(scores, pollinators=1, timestamp="2024-05-01 10:00:00"):
+    flowers = [
+        {"index": i, "class_name": "daisy", "score": s, "size": [300, 280]}
+        for i, s in enumerate(scores)
+    ]
+    return {
+        "detections": {
+            "flowers": flowers,
+            "pollinators": [
+                {
+                    "index": i,
+                    "flower_index": 0,
+                    "class_name": "bee",
+                    "score": 0.8,
+                    "crop": CROP,
+                }
+                for i in range(pollinators)
+            ],
+        },
+        "metadata": {"node_id": "n1", "capture_timestamp": timestamp},
+    }
+
+
+def test_only_changed_fields_are_sent():
+    old = [{"index": 0, "class_name": "daisy", "score": 0.5, "crop": CROP}]
+    new = [{"index": 0, "class_name": "daisy", "score": 0.7, "crop": CROP}]
+    delta = diff_detections(old, new, score_tolerance=0.01)
+    assert delta["changed"] == [
+        {"key": [0, "daisy", 0], "changed": {"score": 0.7}, "removed": []}
+    ]
+    assert apply_detections(old, delta) == new
+
+
+def test_removed_fields():
+    old = [{"index": 0, "score": 0.5, "skipped": "score"}]
+    new = [{"index": 0, "score": 0.5}]
+    delta = diff_detections(old, new)
+    assert apply_detections(old, delta) == new
+
+
+def test_shared_indexes():
+    # multi-label: both classes of the same object share the index
+    old = [
+        {"index": 0, "class_name": "bee", "score": 0.6, "crop": CROP},
+        {"index": 0, "class_name": "wasp", "score": 0.3, "crop": CROP},
+        {"index": 1, "class_name": "bee", "score": 0.5, "crop": CROP},
+        {"index": 1, "class_name": "bee", "score": 0.4, "crop": CROP},
+    ]
+    new = copy.deepcopy(old)
+    new[1]["score"] = 0.5
+    new[3]["score"] = 0.2
+    delta = diff_detections(old, new, score_tolerance=0.01)
+    assert delta["added"] == [] and delta["removed"] == []
+    assert [d["key"] for d in delta["changed"]] == [[0, "wasp", 0], [1, "bee", 1]]
+    assert apply_detections(old, delta) == new
+    # one label dropped, another added
+    newer = [new[0], new[2], new[3]] + [
+        {"index": 0, "class_name": "fly", "score": 0.2, "crop": CROP}
+    ]
+    delta = diff_detections(new, newer)
+    assert delta["removed"] == [[0, "wasp", 0]]
+    assert "order" not in delta
+    assert apply_detections(new, delta) == newer
+    # reordered
+    reordered = [newer[3], newer[0], newer[1], newer[2]]
+    delta = diff_detections(newer, reordered)
+    assert delta["added"] == [] and delta["changed"] == []
+    assert apply_detections(newer, delta) == reordered
+
+
+def test_round_trip_with_shared_indexes():
+    random.seed(2)
+    encoder = DeltaEncoder(keyframe_interval=10, score_tolerance=0)
+    receiver = DeltaReconstructor()
+    for frame in range(30):
+        message = make_message([0.5], pollinators=0, timestamp=str(frame))
+        message["detections"]["pollinators"] = [
+            {
+                "index": i // 2,
+                "flower_index": 0,
+                "class_name": random.choice(["bee", "wasp"]),
+                "score": random.choice([0.3, 0.6]),
+                "crop": CROP,
+            }
+            for i in range(random.randint(1, 4))
+        ]
+        encoded = encoder.encode("n1", message)
+        assert receiver.apply(json.loads(json.dumps(encoded))) == message
+
+
+def test_score_jitter_is_not_sent():
+    random.seed(0)
+    encoder = DeltaEncoder(keyframe_interval=30, score_tolerance=0.01)
+    scores = [0.9 - i * 0.01 for i in range(10)]
+    encoder.encode("n1", make_message(scores))
+    jittered = [s + random.choice([-0.001, 0.001]) for s in scores]
+    message = make_message(jittered, timestamp="2024-05-01 10:00:10")
+    encoded = encoder.encode("n1", message)
+    assert encoded["type"] == "delta"
+    assert encoded["flowers"]["changed"] == []
+    assert len(json.dumps(encoded)) < len(json.dumps(message)) / 5
+
+
+def test_keyframe_if_delta_is_not_smaller():
+    encoder = DeltaEncoder(keyframe_interval=30)
+    encoder.encode("n1", make_message([0.5], pollinators=0))
+    # everything changed
+    message = make_message([0.9, 0.8], pollinators=0, timestamp="later")
+    message["detections"]["flowers"][0]["class_name"] = "rose"
+    encoded = encoder.encode("n1", message)
+    assert encoded["type"] == "keyframe"
+
+
+def test_round_trip_within_tolerance():
+    random.seed(1)
+    encoder = DeltaEncoder(keyframe_interval=10, score_tolerance=0.01)
+    receiver = DeltaReconstructor()
+    scores = [0.5, 0.6, 0.7]
+    for frame in range(50):
+        # slow drift: every single change is below the tolerance
+        scores = [s + 0.004 for s in scores]
+        message = make_message(
+            scores, pollinators=random.randint(0, 3), timestamp=str(frame)
+        )
+        received = receiver.apply(encoder.encode("n1", message))
+        assert received["metadata"] == message["metadata"]
+        assert (
+            received["detections"]["pollinators"]
+            == message["detections"]["pollinators"]
+        )
+        for got, expected in zip(
+            received["detections"]["flowers"], message["detections"]["flowers"]
+        ):
+            assert abs(got["score"] - expected["score"]) <= 0.01
+            assert {k: v for k, v in got.items() if k != "score"} == {
+                k: v for k, v in expected.items() if k != "score"
+            }
+
+
+def test_lost_message_waits_for_keyframe():
+    encoder = DeltaEncoder(keyframe_interval=3)
+    receiver = DeltaReconstructor()
+    receiver.apply(encoder.encode("n1", make_message([0.5], timestamp="0")))
+    encoder.encode("n1", make_message([0.6], timestamp="1"))  # lost
+    assert (
+        receiver.apply(encoder.encode("n1", make_message([0.7], timestamp="2"))) is None
+    )
+    keyframe = encoder.encode("n1", make_message([0.8], timestamp="3"))
+    assert keyframe["type"] == "keyframe"
+    assert receiver.apply(keyframe) == make_message([0.8], timestamp="3")
@@ -0,0 +1,133 @@
+import multiprocessing
+import os
+import socket
+import threading
+import time
+
+from distributed import Coordinator, CoordinatorClient
+from inputs import InputImage
+
+LEASE_TIMEOUT = 0.5
+
+
+def get_free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def dead_worker(port, leased):
+    """
+    Lease a batch and crash without reporting
+    """
+    client = CoordinatorClient("127.0.0.1", port, batch_size=2, worker_id="dead")
+    client.get_next()
+    leased.set()
+    os._exit(1)
+
+
+def slow_worker(port, leased, go):
+    """
+    Lease a batch and report the results after the lease expired
+    """
+    client = CoordinatorClient("127.0.0.1", port, batch_size=2, worker_id="slow")
+    items = [client.get_next(), client.get_next()]
+    leased.set()
+    go.wait(10)
+    for item in items:
+        client.report(item, {"worker": "slow"}, 0.1)
+
+
+def live_worker(port, expected, timeout=10):
+    client = CoordinatorClient("127.0.0.1", port, batch_size=3, worker_id="live")
+    processed = 0
+    deadline = time.time() + timeout
+    while processed < expected and time.time() < deadline:
+        item = client.get_next()
+        if item is None:
+            # wait for the leases of the other workers to expire
+            time.sleep(0.1)
+            continue
+        assert item.data == item.filename.encode()
+        client.report(item, {"worker": "live"}, 0.01)
+        processed += 1
+
+
+class CoordinatorThread:
+    def __init__(self, items):
+        self.items = list(items)
+        self.results = []
+        self.done = []
+        self.port = get_free_port()
+        self.coordinator = Coordinator(
+            self.port,
+            lambda: self.items.pop(0) if len(self.items) > 0 else None,
+            lambda item, message: self.results.append((item.filename, message)),
+            self.done.append,
+            batch_size=3,
+            lease_timeout=LEASE_TIMEOUT,
+        )
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            self.coordinator.poll(50)
+
+    def stop(self):
+        self.running = False
+        self.thread.join(5)
+        self.coordinator.socket.close(linger=0)
+
+
+def test_expired_leases_are_requeued_and_late_results_dropped():
+    filenames = ["node{}_2024-05-01T10-00-00Z.jpg".format(i) for i in range(6)]
+    coordinator = CoordinatorThread([InputImage(f, data=f.encode()) for f in filenames])
+    ctx = multiprocessing.get_context("fork")
+    try:
+        dead_leased = ctx.Event()
+        dead = ctx.Process(target=dead_worker, args=(coordinator.port, dead_leased))
+        dead.start()
+        assert dead_leased.wait(10)
+        slow_leased, go = ctx.Event(), ctx.Event()
+        slow = ctx.Process(target=slow_worker, args=(coordinator.port, slow_leased, go))
+        slow.start()
+        assert slow_leased.wait(10)
+
+        live = ctx.Process(target=live_worker, args=(coordinator.port, 6))
+        live.start()
+        live.join(15)
+        assert live.exitcode == 0
+
+        # the slow worker reports after its images were done by the live worker
+        go.set()
+        slow.join(10)
+        assert slow.exitcode == 0
+        dead.join(5)
+        time.sleep(0.2)
+    finally:
+        coordinator.stop()
+
+    assert sorted(f for f, _ in coordinator.results) == filenames
+    assert all(message == {"worker": "live"} for _, message in coordinator.results)
+    assert len(coordinator.done) == 6
+    assert coordinator.coordinator.pending() == 0
+    assert coordinator.coordinator.leases == {}
+    workers = coordinator.coordinator.workers
+    assert workers["live"].images == 6
+    assert workers["slow"].images == 2
+    assert workers["dead"].images == 0
+
+
+def test_failed_result_is_done_without_output():
+    coordinator = CoordinatorThread([InputImage("node0_x.jpg", data=b"x")])
+    try:
+        client = CoordinatorClient("127.0.0.1", coordinator.port, worker_id="w")
+        item = client.get_next()
+        client.report(item, None, 0.1)
+        assert client.get_next() is None
+    finally:
+        coordinator.stop()
+    assert coordinator.results == [("node0_x.jpg", None)]
+    assert len(coordinator.done) == 1
@@ -0,0 +1,49 @@
+from gating import FlowerGate, create_flower_gate
+
+NAMES = ["daisy", "rose", "daisy", "daisy", "daisy"]
+SCORES = [0.9, 0.8, 0.3, 0.7, 0.6]
+SIZES = [(200, 180), (200, 200), (200, 200), (30, 400), (150, 120)]
+
+
+def test_disabled():
+    gate = create_flower_gate(None)
+    assert not gate.is_enabled()
+    assert gate.select(NAMES, SCORES, SIZES) == [None] * 5
+
+
+def test_reasons():
+    gate = FlowerGate(min_score=0.5, min_crop_size=64, classes=["daisy"])
+    assert gate.is_enabled()
+    assert gate.select(NAMES, SCORES, SIZES) == [None, "class", "score", "size", None]
+
+
+def test_reason_precedence():
+    # a flower failing several checks gets the first reason: class, score, size
+    gate = FlowerGate(min_score=0.5, min_crop_size=64, classes=["daisy"])
+    assert gate.select(["rose"], [0.1], [(10, 10)]) == ["class"]
+    assert gate.select(["daisy"], [0.1], [(10, 10)]) == ["score"]
+
+
+def test_top_k():
+    gate = FlowerGate(top_k=2)
+    assert gate.select(NAMES, SCORES, SIZES) == [None, None, "top_k", "top_k", "top_k"]
+
+
+def test_top_k_among_passed_flowers():
+    # the skipped rose does not take one of the top_k places
+    gate = FlowerGate(classes=["daisy"], top_k=2)
+    assert gate.select(NAMES, SCORES, SIZES) == [None, "class", "top_k", None, "top_k"]
+    gate = FlowerGate(min_score=0.5, top_k=10)
+    assert gate.select(NAMES, SCORES, SIZES) == [None, None, "score", None, None]
+
+
+def test_create_flower_gate():
+    gate = create_flower_gate(
+        {"min_flower_score": 0.4, "min_crop_size": 32, "classes": ["daisy"], "top_k": 3}
+    )
+    assert (gate.min_score, gate.min_crop_size, gate.classes, gate.top_k) == (
+        0.4,
+        32,
+        ["daisy"],
+        3,
+    )
@@ -0,0 +1,297 @@
+import base64
+import json
+import os
+import random
+import subprocess
+import sys
+import tarfile
+import threading
+import zipfile
+from io import BytesIO
+from multiprocessing import resource_tracker, shared_memory
+
+import pytest
+import zmq
+from PIL import Image
+
+from inputs import (
+    ArchiveInput,
+    DirectoryInput,
+    InputImage,
+    ZMQClient,
+    get_message_data,
+    read_shared_memory,
+)
+
+FILENAME = "0344-6782_2024-05-01T10-00-00Z.jpg"
+PACKAGE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def encode_jpeg(size=(32, 24)):
+    bio = BytesIO()
+    Image.new("RGB", size, (0, 128, 0)).save(bio, format="JPEG")
+    return bio.getvalue()
+
+
+def encode_noise(seed, size=(256, 192)):
+    """
+    JPEG of a realistic size (about 40 kB)
+    """
+    random.seed(seed)
+    bio = BytesIO()
+    Image.frombytes("RGB", size, random.randbytes(size[0] * size[1] * 3)).save(
+        bio, format="JPEG"
+    )
+    return bio.getvalue()
+
+
+def create_segment(data):
+    """
+    Shared memory segment as the capture software would create it:
+    the consumer is responsible for removing it
+    """
+    shm = shared_memory.SharedMemory(create=True, size=len(data))
+    shm.buf[: len(data)] = data
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def segment_exists(name):
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return False
+    resource_tracker.unregister(shm._name, "shared_memory")
+    shm.close()
+    return True
+
+
+class Producer:
+    """
+    Local stand-in for the message queue of the capture software,
+    answers each request with the next list of frames
+    """
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.socket = zmq.Context().instance().socket(zmq.REP)
+        self.socket.bind("tcp://127.0.0.1:*")
+        self.port = int(self.socket.getsockopt_string(zmq.LAST_ENDPOINT).split(":")[-1])
+        self.requests = []
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def _serve(self):
+        for frames in self.replies:
+            self.requests.append(self.socket.recv_json())
+            self.socket.send_multipart(frames)
+        self.socket.close()
+
+
+def request(producer):
+    client = ZMQClient("127.0.0.1", producer.port, timeout=2000, retries=1)
+    return client.request_message(1)
+
+
+@pytest.fixture
+def jpeg():
+    return encode_jpeg()
+
+
+def test_multipart_reply(jpeg):
+    producer = Producer([[json.dumps({"filename": FILENAME}).encode(), jpeg]])
+    msg = request(producer)
+    producer.thread.join(2)
+    assert producer.requests == [1]
+    assert msg["filename"] == FILENAME
+    data = get_message_data(msg)
+    assert data == jpeg
+    item = InputImage(msg["filename"], data=data)
+    assert not item.is_file()
+    assert item.get_image().size == (32, 24)
+
+
+def test_base64_reply(jpeg):
+    reply = {"filename": FILENAME, "image": base64.b64encode(jpeg).decode("utf-8")}
+    producer = Producer([[json.dumps(reply).encode()]])
+    msg = request(producer)
+    assert get_message_data(msg) == jpeg
+
+
+def test_filename_only_reply():
+    producer = Producer([[json.dumps({"filename": FILENAME}).encode()]])
+    msg = request(producer)
+    assert get_message_data(msg) is None
+
+
+def test_no_data_reply():
+    producer = Producer([[json.dumps(0).encode()]])
+    assert request(producer) == 0
+
+
+@pytest.mark.parametrize("unlink", [True, False])
+def test_shared_memory_reply(jpeg, unlink):
+    shm = create_segment(jpeg)
+    try:
+        reply = {
+            "filename": FILENAME,
+            "shm_name": shm.name,
+            "shm_size": len(jpeg),
+            "shm_unlink": unlink,
+        }
+        producer = Producer([[json.dumps(reply).encode()]])
+        msg = request(producer)
+        assert get_message_data(msg) == jpeg
+        assert segment_exists(shm.name) != unlink
+    finally:
+        shm.close()
+        if not unlink:
+            shm.unlink()
+
+
+@pytest.mark.parametrize("unlink", [True, False])
+def test_shared_memory_separate_consumer(jpeg, unlink):
+    """
+    The segment is read by another process, whose resource tracker must
+    neither complain nor remove a segment which is kept
+    """
+    shm = create_segment(jpeg)
+    try:
+        code = (
+            "import sys; sys.path.insert(0, {!r}); "
+            "from inputs import read_shared_memory; "
+            "sys.stdout.write(read_shared_memory({!r}, {}, unlink={}).hex())"
+        ).format(PACKAGE_DIR, shm.name, len(jpeg), unlink)
+        result = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, timeout=30
+        )
+        assert result.returncode == 0, result.stderr
+        assert bytes.fromhex(result.stdout) == jpeg
+        assert "Traceback" not in result.stderr
+        assert "leaked" not in result.stderr
+        assert segment_exists(shm.name) != unlink
+    finally:
+        shm.close()
+        if not unlink:
+            shm.unlink()
+
+
+def test_read_shared_memory_without_size(jpeg):
+    shm = create_segment(jpeg)
+    try:
+        data = read_shared_memory(shm.name, unlink=True)
+    finally:
+        shm.close()
+    assert data[: len(jpeg)] == jpeg
+
+
+def test_directory_scan(tmp_path):
+    for i in range(3):
+        (tmp_path / "n1_{}.jpg".format(i)).write_bytes(b"")
+    dir_input = DirectoryInput(str(tmp_path))
+    dir_input.scan()
+    assert dir_input.pending() == 3
+    (tmp_path / "n1_3.jpg").write_bytes(b"")
+    files = [dir_input.get_next(scan=False) for _ in range(4)]
+    assert files[3] is None
+    assert dir_input.pending() == 0
+    # only the new file is added
+    assert os.path.basename(dir_input.get_next()) == "n1_3.jpg"
+    dir_input.scan()
+    assert dir_input.get_next(scan=False) is None
+
+
+ARCHIVE_IMAGES = ["n1_{:02d}.jpg".format(i) for i in range(20)]
+
+
+@pytest.fixture(params=["tar", "tar.gz", "tar.bz2", "zip"])
+def archive(request, tmp_path):
+    path = str(tmp_path / "images.{}".format(request.param))
+    members = [(name, encode_noise(i)) for i, name in enumerate(ARCHIVE_IMAGES)]
+    members.insert(5, ("notes.txt", b"not an image"))
+    if request.param == "zip":
+        with zipfile.ZipFile(path, "w") as zf:
+            zf.writestr("subdir/", b"")
+            for name, data in members:
+                zf.writestr(name, data)
+    else:
+        mode = {"tar": "w", "tar.gz": "w:gz", "tar.bz2": "w:bz2"}[request.param]
+        with tarfile.open(path, mode) as tar:
+            tar.addfile(tarfile.TarInfo("subdir"), None)
+            for name, data in members:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, BytesIO(data))
+    return path
+
+
+def read_archive(archive_input, count=None):
+    items = []
+    while count is None or len(items) < count:
+        item = archive_input.get_next()
+        if item is None:
+            break
+        items.append(item)
+    return items
+
+
+def test_archive_reads_images(archive):
+    archive_input = ArchiveInput(archive)
+    items = read_archive(archive_input)
+    assert [i.filename for i in items] == ARCHIVE_IMAGES
+    assert Image.open(BytesIO(items[0].data)).size == (256, 192)
+    assert archive_input.get_remaining() == 0
+
+
+def test_archive_resume(archive, tmp_path):
+    checkpoint_file = str(tmp_path / "checkpoint.json")
+    archive_input = ArchiveInput(
+        archive, checkpoint_file=checkpoint_file, checkpoint_interval=1
+    )
+    items = read_archive(archive_input, 10)
+    # done out of order, n1_03 is still being processed when the run is interrupted
+    for i in [1, 0, 2, 5, 4, 9, 8, 7, 6]:
+        archive_input.mark_done(items[i])
+    archive_input.members.close()
+
+    archive_input = ArchiveInput(
+        archive, checkpoint_file=checkpoint_file, checkpoint_interval=1
+    )
+    items = read_archive(archive_input)
+    assert [i.filename for i in items] == ARCHIVE_IMAGES[3:]
+    for item in items:
+        archive_input.mark_done(item)
+    with open(checkpoint_file) as f:
+        assert json.load(f)[os.path.abspath(archive)]["finished"]
+
+    # finished archives are skipped
+    archive_input = ArchiveInput(archive, checkpoint_file=checkpoint_file)
+    assert archive_input.get_next() is None
+    assert archive_input.get_remaining() == 0
+
+
+def test_archive_resume_multiple(archive, tmp_path):
+    checkpoint_file = str(tmp_path / "checkpoint.json")
+    other = str(tmp_path / "other.tar")
+    with tarfile.open(other, "w") as tar:
+        for name in ["n2_00.jpg", "n2_01.jpg"]:
+            data = encode_jpeg()
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, BytesIO(data))
+    archive_input = ArchiveInput(
+        [other, archive], checkpoint_file=checkpoint_file, checkpoint_interval=1
+    )
+    for item in read_archive(archive_input, 4):
+        archive_input.mark_done(item)
+    archive_input.members.close()
+
+    archive_input = ArchiveInput([other, archive], checkpoint_file=checkpoint_file)
+    assert [i.filename for i in read_archive(archive_input)] == ARCHIVE_IMAGES[2:]
+
+
+def test_archive_remaining(archive):
+    archive_input = ArchiveInput(archive)
+    for read in range(1, len(ARCHIVE_IMAGES) + 1):
+        archive_input.get_next()
+        assert abs(archive_input.get_remaining() - (len(ARCHIVE_IMAGES) - read)) <= 1
@@ -0,0 +1,128 @@
+import pytest
+
+import loadshedding
+from loadshedding import LoadShedder
+
+
+@pytest.mark.parametrize(
+    "level",
+    [
+        {"sample_every": 0},
+        {"sample_every": -2},
+        {"image_size": 0},
+        {"image_size": -320},
+        {"max_det": 0},
+        {"max_det": 2.5},
+        {"unknown": 1},
+    ],
+)
+def test_invalid_levels(level):
+    with pytest.raises(ValueError):
+        LoadShedder([{"augment": False}, level])
+
+
+LEVELS = [{"augment": False}, {"image_size": 480, "max_det": 5}, {"sample_every": 2}]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(loadshedding.time, "time", clock.time)
+    return clock
+
+
+def create_shedder(**kwargs):
+    options = dict(
+        max_backlog=100,
+        resume_ratio=0.5,
+        step_interval=30,
+        recovery_time=60,
+        smoothing=1,
+    )
+    options.update(kwargs)
+    return LoadShedder(LEVELS, **options)
+
+
+def test_level_steps_up(clock):
+    shedder = create_shedder()
+    assert shedder.update(50) == 0
+    assert shedder.update(150) == 1
+    # at most one step per step_interval
+    clock.now += 10
+    assert shedder.update(150) == 1
+    clock.now += 20
+    assert shedder.update(150) == 2
+    clock.now += 30
+    assert shedder.update(150) == 3
+    clock.now += 30
+    assert shedder.update(150) == 3
+    assert shedder.get_settings() == {
+        "augment": False,
+        "image_size": 480,
+        "max_det": 5,
+        "sample_every": 2,
+    }
+    assert shedder.get_metadata()["level"] == 3
+
+
+def test_level_recovers(clock):
+    shedder = create_shedder()
+    for i in range(2):
+        shedder.update(150)
+        clock.now += 30
+    assert shedder.level == 2
+    # between resume_ratio * max_backlog and max_backlog: the level is kept
+    for i in range(5):
+        clock.now += 30
+        assert shedder.update(80) == 2
+    # below resume_ratio * max_backlog for recovery_time: one level down
+    assert shedder.update(40) == 2
+    clock.now += 59
+    assert shedder.update(40) == 2
+    clock.now += 1
+    assert shedder.update(40) == 1
+    clock.now += 30
+    assert shedder.update(40) == 1
+    # interrupted by a backlog above the resume threshold
+    assert shedder.update(60) == 1
+    clock.now += 30
+    assert shedder.update(40) == 1
+    clock.now += 60
+    assert shedder.update(40) == 0
+    assert shedder.get_settings() == {}
+
+
+def test_latency(clock):
+    shedder = create_shedder(max_backlog=None, max_latency=300, smoothing=0.5)
+    assert shedder.update(1000) == 0
+    assert shedder.update(1000, latency=400) == 1
+    clock.now += 30
+    # smoothed: 400 -> 250
+    assert shedder.update(1000, latency=100) == 1
+    assert shedder.latency == 250
+    clock.now += 60
+    for latency in [100, 100, 100]:
+        shedder.update(1000, latency=latency)
+    assert shedder.latency < 150
+    clock.now += 60
+    assert shedder.update(1000, latency=100) == 0
+
+
+def test_should_skip(clock):
+    shedder = create_shedder()
+    assert not any(shedder.should_skip("a") for i in range(4))
+    for i in range(3):
+        shedder.update(150)
+        clock.now += 30
+    skipped = [shedder.should_skip("a") for i in range(4)]
+    assert skipped == [False, True, False, True]
+    # counted per node
+    assert not shedder.should_skip("b")
@@ -0,0 +1,58 @@
+from regions import (
+    RegionPlanner,
+    assign_to_regions,
+    create_region_planner,
+    find_duplicates,
+    merge_regions,
+)
+
+# two crops forming an L, merged into a 400x400 window
+CROP_A = [0, 0, 400, 100]
+CROP_B = [0, 50, 100, 400]
+
+
+def test_merge_overlapping_crops():
+    windows = merge_regions([CROP_A, CROP_B])
+    assert windows == [([0, 0, 400, 400], [0, 1])]
+
+
+def test_no_merge_above_max_size():
+    windows = merge_regions([CROP_A, CROP_B], max_size=300)
+    assert len(windows) == 2
+
+
+def test_assign_to_smallest_containing_crop():
+    assert assign_to_regions([10, 60, 30, 90], [CROP_A, CROP_B]) == [1, 0]
+    assert assign_to_regions([300, 20, 340, 60], [CROP_A, CROP_B]) == [0]
+
+
+def test_outside_every_crop_is_not_assigned():
+    # inside the merged window, but in the empty corner
+    assert assign_to_regions([250, 250, 300, 300], [CROP_A, CROP_B]) == []
+
+
+def test_find_duplicates_across_windows():
+    boxes = [[10, 10, 50, 50], [12, 11, 51, 50], [12, 11, 51, 50], [200, 200, 240, 240]]
+    scores = [0.6, 0.9, 0.8, 0.7]
+    names = ["bee", "bee", "bee", "bee"]
+    windows = [0, 1, 1, 1]
+    # 0 is a duplicate of 1 (other window, higher score), 2 is in the same window as 1
+    assert find_duplicates(boxes, scores, names, windows) == {0: 1}
+
+
+def test_find_duplicates_keeps_other_classes():
+    boxes = [[10, 10, 50, 50], [12, 11, 51, 50]]
+    assert find_duplicates(boxes, [0.6, 0.9], ["bee", "fly"], [0, 1]) == {}
+
+
+def test_planner_disabled():
+    planner = create_region_planner(None)
+    assert planner.plan([CROP_A, CROP_B]) == [(CROP_A, [0]), (CROP_B, [1])]
+    assert (
+        planner.find_duplicates([CROP_A, CROP_A], [1, 1], ["bee", "bee"], [0, 1]) == {}
+    )
+
+
+def test_planner_enabled():
+    planner = RegionPlanner(enabled=True, dedupe_iou=0.5)
+    assert planner.plan([CROP_A, CROP_B]) == [([0, 0, 400, 400], [0, 1])]
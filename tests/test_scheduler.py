@@ -0,0 +1,127 @@
+import time
+from collections import Counter
+
+import pytest
+
+import scheduler as scheduler_module
+from scheduler import NodeScheduler, get_node_id
+
+
+def add_images(scheduler, node_id, count, added=None):
+    for i in range(count):
+        scheduler.add("{}_{}.jpg".format(node_id, i), added=added)
+
+
+def drain(scheduler, count=None):
+    items = []
+    while count is None or len(items) < count:
+        item = scheduler.get_next()
+        if item is None:
+            break
+        scheduler.complete(item)
+        items.append(item)
+    return items
+
+
+def test_get_node_id():
+    assert get_node_id("/data/0344-6782_2024-05-01T10-00-00Z.jpg") == "0344-6782"
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        NodeScheduler(policy="random")
+
+
+def test_fifo():
+    scheduler = NodeScheduler(policy="fifo")
+    scheduler.add("a_0.jpg")
+    scheduler.add("b_0.jpg")
+    scheduler.add("a_1.jpg")
+    assert drain(scheduler) == ["a_0.jpg", "b_0.jpg", "a_1.jpg"]
+    assert scheduler.get_next() is None
+
+
+def test_round_robin_weights():
+    scheduler = NodeScheduler(policy="round_robin", weights={"a": 3, "c": 2})
+    for node_id in ["a", "b", "c"]:
+        add_images(scheduler, node_id, 60)
+    served = Counter(get_node_id(i) for i in drain(scheduler, 60))
+    assert served == {"a": 30, "b": 10, "c": 20}
+    # smooth: the heaviest node is never served more than twice in a row
+    scheduler = NodeScheduler(policy="round_robin", weights={"a": 2})
+    add_images(scheduler, "a", 20)
+    add_images(scheduler, "b", 20)
+    nodes = "".join(get_node_id(i) for i in drain(scheduler, 12))
+    assert "aaa" not in nodes and nodes.count("a") == 8
+
+
+def test_burst_does_not_starve_other_nodes():
+    scheduler = NodeScheduler(policy="round_robin")
+    add_images(scheduler, "a", 2000)
+    add_images(scheduler, "b", 5)
+    nodes = [get_node_id(i) for i in drain(scheduler, 10)]
+    assert nodes == ["a", "b"] * 5
+    assert scheduler.pending("a") == 1995 and scheduler.pending("b") == 0
+
+
+def test_deadline_order():
+    now = time.time()
+    scheduler = NodeScheduler(
+        policy="deadline",
+        latency_targets={"fast": 60},
+        default_latency_target=600,
+    )
+    # deadlines: slow_0 now + 400, fast_0 now + 30, slow_1 now + 500, fast_1 now + 50
+    scheduler.add("slow_0.jpg", added=now - 200)
+    scheduler.add("slow_1.jpg", added=now - 100)
+    scheduler.add("fast_0.jpg", added=now - 30)
+    scheduler.add("fast_1.jpg", added=now - 10)
+    assert drain(scheduler) == ["fast_0.jpg", "fast_1.jpg", "slow_0.jpg", "slow_1.jpg"]
+
+
+@pytest.fixture
+def warnings(monkeypatch):
+    messages = []
+    monkeypatch.setattr(scheduler_module.log, "warning", messages.append)
+    return messages
+
+
+def test_latency_from_capture_time(warnings):
+    scheduler = NodeScheduler(default_latency_target=60)
+    scheduler.add("a_0.jpg", added=time.time() - 50)
+    item = scheduler.get_next()
+    assert scheduler.is_live(item)
+    assert scheduler.get_latency(item) == pytest.approx(50, abs=1)
+    assert scheduler.get_wait_time(item) == pytest.approx(0, abs=1)
+    scheduler.complete(item)
+    assert scheduler.get_stats()["a"]["latency_max"] == pytest.approx(50, abs=1)
+    assert warnings == []
+    # queued within the target, but the result is late
+    scheduler.add("a_1.jpg", added=time.time() - 59)
+    item = scheduler.get_next()
+    time.sleep(1.1)
+    scheduler.complete(item)
+    assert len(warnings) == 1 and "missed its latency target" in warnings[0]
+
+
+def test_backfill_is_measured_from_queueing(warnings):
+    scheduler = NodeScheduler(default_latency_target=600)
+    # captured months ago, e.g. from an archive
+    scheduler.add("a_0.jpg", added=time.time() - 90 * 24 * 3600)
+    item = scheduler.get_next()
+    assert not scheduler.is_live(item)
+    assert scheduler.get_latency(item) == pytest.approx(0, abs=1)
+    scheduler.complete(item)
+    assert scheduler.get_stats()["a"]["latency_max"] < 1
+    assert warnings == []
+
+
+def test_stats():
+    scheduler = NodeScheduler()
+    add_images(scheduler, "a", 3)
+    add_images(scheduler, "b", 1)
+    drain(scheduler, 2)
+    stats = scheduler.get_stats()
+    assert stats["a"]["processed"] == 2 and stats["a"]["backlog"] == 1
+    assert stats["b"]["processed"] == 0 and stats["b"]["backlog"] == 1
+    assert stats["b"]["latency_mean"] is None
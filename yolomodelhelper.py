@@ -1,6 +1,7 @@
 import torch
 import time
 import os
+import hashlib
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 import logging
@@ -22,6 +23,7 @@ class YoloModel:
         amp=False,
         agnostic=False,
         max_det=10,
+        version=None,
     ):
         if yolov5_path is None:
             self.model = torch.hub.load("ultralytics/yolov5", "custom", model_path)
@@ -30,6 +32,9 @@ class YoloModel:
                 yolov5_path, "custom", model_path, source="local"
             )
         self.model_name = model_path.split("/")[-1]
+        if version is None:
+            version = self._compute_version(model_path)
+        self.model_version = version
         self.model.conf = confidence_threshold
         self.model.iou = iou_threshold
         self.model.agnostic = agnostic  # NMS class-agnostic
@@ -42,6 +47,11 @@ class YoloModel:
         self.augment = augment
         self.class_names = class_names
         self.multi_label_iou_threshold = multi_label_iou_threshold
+        self.base_settings = {
+            "augment": self.augment,
+            "image_size": self.image_size,
+            "max_det": self.model.max_det,
+        }
         self.results = None
         self.total_inference_time = 0
         self.number_of_inferences = 0
@@ -54,8 +64,10 @@ class YoloModel:
         metadata["multi_label"] = self.model.multi_label
         metadata["multi_label_iou_threshold"] = self.multi_label_iou_threshold
         metadata["model_name"] = self.model_name
+        metadata["model_version"] = self.model_version
         metadata["max_det"] = self.model.max_det
         metadata["augment"] = self.augment
+        metadata["image_size"] = self.image_size
         total_inference_time, average_inference_time = self.get_inference_times()
         if total_inference_time is not None:
             metadata["inference_times"] = [round(total_inference_time, 3)]
@@ -64,6 +76,41 @@ class YoloModel:
 
         return metadata
 
+    def apply_overrides(self, overrides):
+        """
+        Override augment, image_size and max_det, settings which are not
+        in overrides are reset to the configured values
+        """
+        self.augment = overrides.get("augment", self.base_settings["augment"])
+        self.image_size = overrides.get("image_size", self.base_settings["image_size"])
+        self.model.max_det = overrides.get("max_det", self.base_settings["max_det"])
+
+    def _compute_version(self, model_path):
+        """
+        Short hash of the weights file
+        """
+        if not os.path.isfile(model_path):
+            return None
+        sha = hashlib.sha256()
+        with open(model_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+        return sha.hexdigest()[:12]
+
+    def warmup(self, passes=1, batch_size=1):
+        """
+        Run inference on blank images, the first inferences are much slower
+        """
+        size = self.image_size or 640
+        blank = np.zeros((size, size, 3), dtype=np.uint8)
+        for i in range(passes):
+            if batch_size > 1:
+                self.predict([blank] * batch_size)
+            else:
+                self.predict(blank)
+        self.results = None
+        self.reset_inference_times()
+
     def reset_inference_times(self):
         self.total_inference_time = 0
         self.number_of_inferences = 0
@@ -80,51 +127,58 @@ class YoloModel:
         )
 
     def predict(self, input):
+        """
+        Run inference on an image or on a list of images (batch).
+        The getters take the position of the image in the batch as index.
+        """
         t0 = time.time()
         self.results = self.model.forward(
             input, augment=self.augment, size=self.image_size
         )
         self.total_inference_time += time.time() - t0
-        self.number_of_inferences += 1
+        if isinstance(input, list):
+            self.number_of_inferences += len(input)
+        else:
+            self.number_of_inferences += 1
         return self.results
 
-    def get_classes(self):
+    def get_classes(self, index=0):
         res = self.results
-        classes = res.pandas().xyxy[0]["class"].tolist()
+        classes = res.pandas().xyxy[index]["class"].tolist()
         return classes
 
-    def get_names(self):
+    def get_names(self, index=0):
         if self.class_names is None:
             res = self.results
-            names = res.pandas().xyxy[0]["name"].tolist()
+            names = res.pandas().xyxy[index]["name"].tolist()
             return names
         else:
-            classes = self.get_classes()
+            classes = self.get_classes(index)
             names = []
             for i in range(len(classes)):
                 names.append(self.class_names[classes[i]])
             return names
 
-    def get_scores(self):
+    def get_scores(self, index=0):
         res = self.results
-        scores = res.pandas().xyxy[0]["confidence"].tolist()
+        scores = res.pandas().xyxy[index]["confidence"].tolist()
         return scores
 
-    def get_boxes(self):
+    def get_boxes(self, index=0):
         res = self.results
         boxes = []
-        for i in range(len(res.pandas().xyxy[0])):
+        for i in range(len(res.pandas().xyxy[index])):
             box = []
-            box.append(res.pandas().xyxy[0].get("xmin")[i])
-            box.append(res.pandas().xyxy[0].get("ymin")[i])
-            box.append(res.pandas().xyxy[0].get("xmax")[i])
-            box.append(res.pandas().xyxy[0].get("ymax")[i])
+            box.append(res.pandas().xyxy[index].get("xmin")[i])
+            box.append(res.pandas().xyxy[index].get("ymin")[i])
+            box.append(res.pandas().xyxy[index].get("xmax")[i])
+            box.append(res.pandas().xyxy[index].get("ymax")[i])
             boxes.append(box)
 
         return boxes
 
-    def get_indexes(self):
-        boxes = self.get_boxes()
+    def get_indexes(self, index=0):
+        boxes = self.get_boxes(index)
         if self.model.multi_label:
             overlapping = []
             for bb1 in range(len(boxes)):
@@ -139,35 +193,59 @@ class YoloModel:
         else:
             return [i for i in range(len(boxes))]
 
-    def get_crops(self):
+    def get_image(self, index=0):
+        """
+        Returns the input image at position index as numpy array (RGB)
+        """
+        return self.results.ims[index]
+
+    def get_crop_boxes(self, index=0):
+        """
+        Returns the boxes of the crops (including the margin) of the image at
+        position index, box format: [x_start, y_start, x_end, y_end]
+        """
+        res = self.results
+        img_array = res.ims[index]
+        image_width = img_array.shape[1]
+        image_height = img_array.shape[0]
+        boxes = []
+        for coordlist in res.xyxy[index].tolist():
+            x_start = int(coordlist[0])
+            if x_start - self.margin < 0:
+                x_start = 0
+            else:
+                x_start = x_start - self.margin
+            y_start = int(coordlist[1])
+            if y_start - self.margin < 0:
+                y_start = 0
+            else:
+                y_start = y_start - self.margin
+            x_end = int(coordlist[2])
+            if x_end + self.margin > image_width:
+                x_end = image_width
+            else:
+                x_end = x_end + self.margin
+            y_end = int(coordlist[3])
+            if y_end + self.margin > image_height:
+                y_end = image_height
+            else:
+                y_end = y_end + self.margin
+            boxes.append([x_start, y_start, x_end, y_end])
+        return boxes
+
+    def get_crops(self, index=None):
+        """
+        Returns the crops of all images, or of the image at position index
+        """
         res = self.results
         crops = []
-        for i in range(len(res.ims)):
+        if index is None:
+            image_indexes = range(len(res.ims))
+        else:
+            image_indexes = [index]
+        for i in image_indexes:
             img_array = res.ims[i]
-            image_width = img_array.shape[1]
-            image_height = img_array.shape[0]
-
-            for coordlist in res.xyxy[i].tolist():
-                x_start = int(coordlist[0])
-                if x_start - self.margin < 0:
-                    x_start = 0
-                else:
-                    x_start = x_start - self.margin
-                y_start = int(coordlist[1])
-                if y_start - self.margin < 0:
-                    y_start = 0
-                else:
-                    y_start = y_start - self.margin
-                x_end = int(coordlist[2])
-                if x_end + self.margin > image_width:
-                    x_end = image_width
-                else:
-                    x_end = x_end + self.margin
-                y_end = int(coordlist[3])
-                if y_end + self.margin > image_height:
-                    y_end = image_height
-                else:
-                    y_end = y_end + self.margin
+            for x_start, y_start, x_end, y_end in self.get_crop_boxes(i):
                 crop = img_array[y_start:y_end, x_start:x_end]
                 crops.append(crop)
         return crops